@@ -1,58 +1,208 @@
 from sentence_transformers import SentenceTransformer
 import pickle
+import time
+import functools
+import os
+import numpy as np
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
-from shared_utils import TEST_MODE
+from shared_utils import TEST_MODE, EMBED_BATCH_SIZE, EMBEDDING_BACKEND, CLASSIFIER_BACKEND, \
+    CASCADE_ENABLED, CASCADE_LOW, CASCADE_HIGH, CHEAP_CLASSIFIER_PATH, NEAR_DUP_ENABLED, SEMANTIC_DEDUP_ENABLED
+from blob_store import has_diff, diff_fields
+from embedding_cache import encode_cached, model_cache_id
+from inference_client import InferenceClient
+from onnx_encoder import OnnxEncoder
+from scoring_head import ScoringHead
+from near_dedup import NearDuplicateIndex, drop_duplicate_comments, drop_duplicate_discussions
+from semantic_index import drop_semantic_duplicates
 import random
 
-def load_models():
+ENCODER_DIR = "../../models/sentence_transformer_model"
 
-    model = SentenceTransformer("../../models/sentence_transformer_model")
-    with open("../../models/best_classifier.pkl", "rb") as f:
-        classifier = pickle.load(f)
+def load_encoder(backend=EMBEDDING_BACKEND):
+    if backend == "onnx":
+        return OnnxEncoder()
+    model = SentenceTransformer(ENCODER_DIR)
+    model.cache_model_id = model_cache_id(ENCODER_DIR)
+    return model
+
+
+# Cached so a process loads the models once, not on every filter_comments call
+@functools.lru_cache(maxsize=2)
+def load_models(backend=EMBEDDING_BACKEND, classifier_backend=CLASSIFIER_BACKEND):
+
+    model = load_encoder(backend)
+
+    if classifier_backend == "npz":
+        classifier = ScoringHead.load("../../models/scoring_head.npz")
+    else:
+        with open("../../models/best_classifier.pkl", "rb") as f:
+            classifier = pickle.load(f)
 
     # with open("../../models/model_info.json", "r") as f:
     #     model_info = json.load(f)
 
     return model, classifier
 
-    
 
-async def filter_comments(data):
 
-    model, classifier = load_models()
+class LocalClassifier:
+    """Sentence transformer plus classifier in this process, same classify API as InferenceClient"""
+
+    def __init__(self, batch_size=EMBED_BATCH_SIZE):
+        self.model, self.classifier = load_models()
+        self.batch_size = batch_size
+
+    def classify(self, texts, return_embeddings=False):
+        """Returns (labels, probs), labels derived from a single predict_proba pass, plus the embeddings if asked"""
+        if not texts:
+            labels, probabilities = np.array([], dtype=int), np.empty((0, len(self.classifier.classes_)))
+            embeddings = np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        else:
+            embeddings = encode_cached(self.model, texts, batch_size=self.batch_size)
+            probabilities = self.classifier.predict_proba(embeddings)
+            labels = self.classifier.classes_[probabilities.argmax(axis=1)]
+
+        if return_embeddings:
+            return labels, probabilities, np.asarray(embeddings, dtype=np.float32)
+        return labels, probabilities
+
+    def embed(self, texts):
+        return encode_cached(self.model, texts, batch_size=self.batch_size)
+
+    def close(self):
+        # The models stay cached in load_models for the next classifier
+        pass
+
+
+class CascadeClassifier:
+    """Cheap hashed n-gram model first: confident comments are decided right away,
+    only the uncertain band between low and high goes to the transformer classifier"""
+
+    def __init__(self, cheap_model, classifier, low=CASCADE_LOW, high=CASCADE_HIGH):
+        self.cheap_model = cheap_model
+        self.classifier = classifier
+        self.low = low
+        self.high = high
+        self.stats = {"cheap_keep": 0, "cheap_drop": 0, "transformer": 0}
+        # Transformer embeddings of the kept comments, handed to the semantic de-duplication instead of encoding them again
+        self.embeddings = {}
+
+    def classify(self, texts):
+        if not texts:
+            return self.classifier.classify(texts)
+
+        probabilities = self.cheap_model.predict_proba(texts)
+        positive = probabilities[:, list(self.cheap_model.classes_).index(1)]
+        labels = (positive >= 0.5).astype(int)
+
+        uncertain = np.flatnonzero((positive > self.low) & (positive < self.high))
+        if len(uncertain):
+            uncertain_texts = [texts[i] for i in uncertain]
+            transformer_labels, transformer_probs, embeddings = self.classifier.classify(uncertain_texts,
+                                                                                         return_embeddings=True)
+            labels[uncertain] = transformer_labels
+            probabilities[uncertain] = transformer_probs
+            self.embeddings.update((text, vector) for text, label, vector
+                                   in zip(uncertain_texts, transformer_labels, embeddings) if label == 1)
+
+        self.stats["cheap_keep"] += int((positive >= self.high).sum())
+        self.stats["cheap_drop"] += int((positive <= self.low).sum())
+        self.stats["transformer"] += len(uncertain)
+
+        return labels, probabilities
+
+    def embed(self, texts):
+        """Only comments the cheap model decided on alone still need the transformer"""
+        missing = list(dict.fromkeys(text for text in texts if text not in self.embeddings))
+        if missing:
+            self.embeddings.update(zip(missing, self.classifier.embed(missing)))
+
+        embeddings = np.array([self.embeddings[text] for text in texts], dtype=np.float32)
+        # Everything classified so far has been through selection, keep memory flat across batches
+        self.embeddings = {}
+        return embeddings
+
+    def close(self):
+        self.classifier.close()
+
+    def report(self):
+        total = max(sum(self.stats.values()), 1)
+        print(f"Cascade: {self.stats['cheap_keep'] / total:.1%} kept by the cheap model, "
+              f"{self.stats['cheap_drop'] / total:.1%} dropped by the cheap model, "
+              f"{self.stats['transformer'] / total:.1%} sent to the transformer")
+
+
+def get_classifier(cascade=CASCADE_ENABLED):
+    """Use the warm models of a running inference_server when there is one, otherwise load them here"""
+    classifier = InferenceClient.connect()
+    if classifier:
+        print("Using inference server")
+    else:
+        classifier = LocalClassifier()
+
+    if cascade:
+        if os.path.exists(CHEAP_CLASSIFIER_PATH):
+            with open(CHEAP_CLASSIFIER_PATH, "rb") as f:
+                classifier = CascadeClassifier(pickle.load(f), classifier)
+        else:
+            print(f"No {CHEAP_CLASSIFIER_PATH}, run sentence-transformer/train_cheap_classifier.py to enable the cascade")
+
+    return classifier
+
+
+def classify_texts(classifier, texts):
+    labels, _ = classifier.classify(texts)
+    return labels
+
+
+def classify_batched(classifier, data):
+    """Classify the comments of every PR in one encode call and scatter the labels back per PR"""
+    texts = []
+    offsets = [0]
+    for item in data:
+        texts.extend(item.get("comments", []))
+        offsets.append(len(texts))
+
+    # encode sorts its input by length internally, so one call over the flattened
+    # comments (the cache misses among them) gives evenly padded batches instead of one ragged batch per PR
+    labels = classify_texts(classifier, texts)
+
+    return [labels[offsets[i]:offsets[i + 1]] for i in range(len(data))]
 
+
+def select_items(data, all_predictions):
+    """Keep the PRs that still have a diff and enough substantial comments after classification"""
     transformed_data = []
     index = 1
-    for item in data:
+    for item, predictions in zip(data, all_predictions):
         comments = item.get("comments", [])
         transformed_comments = []
 
-        #print(comments)
-        embeddings = model.encode(comments)
-        predictions = classifier.predict(embeddings)
-        probabilities = classifier.predict_proba(embeddings)
-
         comment_index = 0
-        for comment, pred, prob in zip(comments, predictions, probabilities):
+        for comment, pred in zip(comments, predictions):
             if pred == 1:
                 transformed_comments.append(comment)
                 #print(f"\nComment index {comment_index} is substantial \n {comment[:100]} \n")
             else:
-                #print(f"\nREMOVED comment {comment_index} ==== Score: {pred}(confidence: {prob}) ==== \nComment:{comment[:100]}\n")
+                #print(f"\nREMOVED comment {comment_index} ==== Score: {pred} ==== \nComment:{comment[:100]}\n")
                 pass
             comment_index += 1
 
         transformed_item = {
             "index": index,
+            "repository": item.get("repository"),
+            "pr_number": item.get("pr_number"),
             "filtered_comments": transformed_comments,
-            "diff": item.get("diff", ""),
-            "diff_length": item.get("diff_length", "")
+            **diff_fields(item)
         }
         comment_num = 7
-        if item.get('diff') and len(transformed_comments) >= comment_num:
+        if has_diff(item) and len(transformed_comments) >= comment_num:
             transformed_data.append(transformed_item)
             index += 1
-        elif not item.get('diff'):
+        elif not has_diff(item):
             print("="*10)
             print(f"\n!!! REMOVED PR{item.get("pr_number")}, No code diff found\n")
             print("="*10)
@@ -66,6 +216,152 @@ async def filter_comments(data):
     return transformed_data
 
 
+def drop_duplicate_items(selected, classifier, discussion_index=None, semantic_index=None):
+    """Near-duplicate discussions first and semantic duplicates last, so only records that pass every other
+    filter get a vector in the semantic index"""
+    if NEAR_DUP_ENABLED:
+        save = discussion_index is None
+        if save:
+            discussion_index = NearDuplicateIndex("discussions")
+        selected = drop_duplicate_discussions(selected, discussion_index)
+        if save:
+            discussion_index.save()
+
+    if SEMANTIC_DEDUP_ENABLED:
+        selected = drop_semantic_duplicates(selected, classifier, index=semantic_index)
+    return selected
+
+
+def classify_all(data, batched=True, classifier=None):
+    if classifier is None:
+        with closing(get_classifier()) as classifier:
+            return classify_all(data, batched, classifier)
+
+    start_time = time.perf_counter()
+    if batched:
+        all_predictions = classify_batched(classifier, data)
+    else:
+        all_predictions = [classify_texts(classifier, item.get("comments", [])) for item in data]
+    elapsed = time.perf_counter() - start_time
+
+    num_comments = sum(len(item.get("comments", [])) for item in data)
+    print(f"Classified {num_comments} comments in {elapsed:.1f}s ({num_comments / max(elapsed, 1e-9):.0f} comments/s)")
+    if isinstance(classifier, CascadeClassifier):
+        classifier.report()
+
+    return all_predictions
+
+
+async def filter_comments(data, batched=True):
+    data = list(data)
+
+    if NEAR_DUP_ENABLED:
+        comment_index = NearDuplicateIndex("comments")
+        drop_duplicate_comments(data, comment_index)
+        comment_index.save()
+
+    # Model inference blocks, so it runs on a worker thread instead of the event loop
+    loop = asyncio.get_running_loop()
+    classifier = await loop.run_in_executor(None, get_classifier)
+    try:
+        all_predictions = await loop.run_in_executor(None, classify_all, data, batched, classifier)
+
+        selected = select_items(data, all_predictions)
+        selected = await loop.run_in_executor(None, drop_duplicate_items, selected, classifier)
+    finally:
+        classifier.close()
+    return selected
+
+
+class FilterWorker:
+    """Classifies PRs while extraction is still running. A single thread holds the loaded models and takes
+    whatever discussions have queued up since its last batch, so network waits and inference overlap."""
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="st-filter")
+        self.queue = asyncio.Queue()
+        self.classified = []
+        self.num_comments = 0
+        self.busy_time = 0.0
+        self.comment_index = None
+        self.classifier = loop.run_in_executor(self.executor, get_classifier)
+        self.consumer = asyncio.create_task(self._consume())
+
+    def submit(self, discussion):
+        self.queue.put_nowait(discussion)
+
+    def _classify(self, classifier, batch):
+        if NEAR_DUP_ENABLED:
+            if self.comment_index is None:
+                self.comment_index = NearDuplicateIndex("comments")
+            drop_duplicate_comments(batch, self.comment_index)
+
+        start_time = time.perf_counter()
+        predictions = classify_batched(classifier, batch)
+        self.busy_time += time.perf_counter() - start_time
+        return predictions
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        classifier = await self.classifier
+
+        done = False
+        while not done:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # None marks the end of extraction
+            if None in batch:
+                done = True
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            predictions = await loop.run_in_executor(self.executor, self._classify, classifier, batch)
+            self.classified.extend(zip(batch, predictions))
+            self.num_comments += sum(len(item.get("comments", [])) for item in batch)
+
+    async def finish(self):
+        """Wait for the queued discussions and return the filtered data in discussion order"""
+        self.queue.put_nowait(None)
+        try:
+            await self.consumer
+        except BaseException:
+            self.shutdown()
+            raise
+
+        print(f"Classified {self.num_comments} comments in {self.busy_time:.1f}s of inference "
+              f"({self.num_comments / max(self.busy_time, 1e-9):.0f} comments/s)")
+        classifier = self.classifier.result()
+        if isinstance(classifier, CascadeClassifier):
+            classifier.report()
+        if self.comment_index is not None:
+            self.comment_index.save()
+
+        self.classified.sort(key=lambda pair: pair[0].get("index", 0))
+        selected = select_items([item for item, _ in self.classified], [pred for _, pred in self.classified])
+
+        # Pooled embeddings come from the cache filled while classifying, on the thread that holds the models
+        try:
+            loop = asyncio.get_running_loop()
+            selected = await loop.run_in_executor(self.executor, drop_duplicate_items, selected, classifier)
+        finally:
+            self.shutdown()
+        return selected
+
+    def cancel(self):
+        self.consumer.cancel()
+        self.shutdown(cancel_futures=True)
+
+    def shutdown(self, cancel_futures=False):
+        """Release the model thread and the classifier, e.g. the inference server connection"""
+        self.executor.shutdown(wait=False, cancel_futures=cancel_futures)
+        if self.classifier.done() and not self.classifier.cancelled() and self.classifier.exception() is None:
+            self.classifier.result().close()
+
+
 def test():
     model, classifier, model_info = load_models()
 
@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import os
+
+from shared_utils import BLOB_DIR
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+''' Content-addressed store for PR diffs. Each diff is compressed once (zstd when available, gzip otherwise) and
+saved under its sha256, records only carry the digest and the length. Stages that need the text call load_diff,
+everything else can filter on diff_length without touching the blob.'''
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+
+    def _path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+
+    def put(self, text):
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+
+        if self.exists(digest):
+            return digest
+
+        if zstandard:
+            path = self._path(digest, 'zst')
+            compressed = zstandard.ZstdCompressor(level=9).compress(data)
+        else:
+            path = self._path(digest, 'gz')
+            compressed = gzip.compress(data, compresslevel=9)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+
+        return digest
+
+    def exists(self, digest):
+        return any(os.path.exists(self._path(digest, ext)) for ext in ('zst', 'gz'))
+
+    def get(self, digest):
+        zst_path = self._path(digest, 'zst')
+        if os.path.exists(zst_path):
+            if zstandard is None:
+                raise RuntimeError(f"Blob {digest} is zstd compressed but zstandard is not installed")
+            with open(zst_path, 'rb') as f:
+                return zstandard.ZstdDecompressor().decompress(f.read()).decode('utf-8')
+
+        with open(self._path(digest, 'gz'), 'rb') as f:
+            return gzip.decompress(f.read()).decode('utf-8')
+
+
+blob_store = BlobStore()
+
+
+def store_diff(codeDiff):
+    """Store a diff and return the fields a record keeps in place of the text"""
+    if not codeDiff:
+        return {'diff_digest': None, 'diff_length': 0}
+
+    return {'diff_digest': blob_store.put(codeDiff), 'diff_length': len(codeDiff)}
+
+
+def diff_fields(record):
+    """The diff fields of a record as downstream stages carry them, including the raw text of older records"""
+    return {key: record[key] for key in ('diff_digest', 'diff_length', 'diff') if record.get(key) is not None}
+
+
+def has_diff(record):
+    return bool(record.get('diff_digest') or record.get('diff'))
+
+
+def load_diff(record):
+    """Diff text of a record, decompressed only when asked for. Older records still carry the raw text"""
+    if record.get('diff') is not None:
+        return record['diff']
+    if record.get('diff_digest'):
+        return blob_store.get(record['diff_digest'])
+    return ''
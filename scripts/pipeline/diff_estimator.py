@@ -0,0 +1,81 @@
+import math
+import os
+
+import numpy as np
+
+from shared_utils import JSONLWriter, readJSONL, DIFF_HISTORY_FILE, DIFF_ESTIMATE_MARGIN, MIN_DIFF_LENGTH, MAX_DIFF_LENGTH
+
+''' Predicts the length of a PR diff from the pulls endpoint metadata (additions, deletions, changed_files) so diffs
+that transform_critique_data would throw away are never downloaded. The model is a fit in log space,
+log(length) = a*log(1 + lines changed) + b*log(1 + files) + c, calibrated on the diffs we have downloaded before.'''
+
+# Roughly 60 characters per changed line until there is enough history to fit
+DEFAULT_COEFFS = (1.0, 0.15, math.log(60))
+MIN_CALIBRATION_SAMPLES = 50
+
+
+class DiffSizeEstimator:
+    def __init__(self, history_file=DIFF_HISTORY_FILE, margin=DIFF_ESTIMATE_MARGIN):
+        self.history_file = history_file
+        self.margin = margin
+        # (repository, pr_number) of every PR in the history, a diff served again from the HTTP cache is not a new sample
+        self.recorded = set()
+        self.coeffs = self.calibrate()
+
+    @staticmethod
+    def features(additions, deletions, changed_files):
+        return [math.log1p(additions + deletions), math.log1p(changed_files), 1.0]
+
+    def calibrate(self):
+        if not os.path.exists(self.history_file):
+            return DEFAULT_COEFFS
+
+        # Older histories have a row per fetch, keep the latest row of each PR
+        latest = {}
+        for h in readJSONL(self.history_file):
+            latest[(h.get('repository'), h.get('pr_number'))] = h
+        self.recorded = set(latest)
+        history = [h for h in latest.values() if h['diff_length'] > 0]
+        if len(history) < MIN_CALIBRATION_SAMPLES:
+            return DEFAULT_COEFFS
+
+        X = np.array([self.features(h['additions'], h['deletions'], h['changed_files']) for h in history])
+        y = np.log([h['diff_length'] for h in history])
+        coeffs, *_ = np.linalg.lstsq(X, y, rcond=None)
+
+        residuals = y - X @ coeffs
+        print(f"Diff size estimator calibrated on {len(history)} diffs (log residual std {residuals.std():.2f})")
+        return tuple(coeffs)
+
+    def estimate(self, additions, deletions, changed_files):
+        log_length = np.dot(self.coeffs, self.features(additions, deletions, changed_files))
+        return int(math.exp(log_length))
+
+    def should_download(self, pr):
+        """False when the diff is predicted to fall well outside the MIN/MAX_DIFF_LENGTH window"""
+        if pr.get('additions') is None or pr.get('changed_files') is None:
+            return True
+
+        predicted = self.estimate(pr['additions'], pr.get('deletions', 0), pr['changed_files'])
+        return MIN_DIFF_LENGTH / self.margin < predicted < MAX_DIFF_LENGTH * self.margin
+
+    def record(self, pr, diff_length):
+        """Keep the real length next to the metadata for the next calibration"""
+        if pr.get('additions') is None or pr.get('changed_files') is None:
+            return
+
+        key = (pr.get('repository_full_name'), pr.get('number'))
+        if key in self.recorded:
+            return
+        self.recorded.add(key)
+
+        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        with JSONLWriter(self.history_file) as writer:
+            writer.write({
+                'repository': pr.get('repository_full_name'),
+                'pr_number': pr.get('number'),
+                'additions': pr['additions'],
+                'deletions': pr.get('deletions', 0),
+                'changed_files': pr['changed_files'],
+                'diff_length': diff_length
+            })
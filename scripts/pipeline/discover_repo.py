@@ -4,6 +4,7 @@ import asyncio
 import json
 
 from shared_utils import saveJSON, summaryDisplay, HEADERS, MAX_REPOS
+from http_cache import cached_get
 
 # Searches python Repos for at least 1000 stars, 100 forks, and not older than Jan 1st 2024
 
@@ -41,17 +42,17 @@ async def searchRepos(session, language, page, skip_ids=None, min_stars=1000, mi
 
   print(f"Repo query: {params['q']}")
 
-  async with session.get(search_url, headers=HEADERS, params=params) as response:
-    data = await response.json()
-    all_repos = data.get('items', [])
-    # if response.status_code != 200:
-    #   print(f"Error: {response.status_code} -  {response.text}") ################################################## For Debugging
-    #   return []
-
-    if skip_ids:
-       all_repos = [repo for repo in all_repos if repo['id'] not in skip_ids]
-       
-    return all_repos
+  status, data, _ = await cached_get(session, search_url, HEADERS, 'search', params=params)
+  if status != 200:
+    print(f"Error searching repos page {page} for {language}: {status}")
+    return []
+
+  all_repos = data.get('items', [])
+
+  if skip_ids:
+     all_repos = [repo for repo in all_repos if repo['id'] not in skip_ids]
+
+  return all_repos
 
 async def searchPages(session, language, skip_ids=None):
   tasks = [searchRepos(session, language, page, skip_ids) for page in range(1, 8)]
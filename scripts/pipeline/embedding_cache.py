@@ -0,0 +1,180 @@
+import fcntl
+import functools
+import hashlib
+import os
+
+import numpy as np
+
+from shared_utils import EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_ID, EMBED_BATCH_SIZE
+
+''' On-disk sentence embedding cache shared by ST_filter_data and train_classifier. Each model identity gets its own
+directory with an append-only float32 matrix (vectors.f32, read through a memory map) and a hash index (index.txt,
+one sha256 of the comment text per line, line n is row n). Only texts missing from the index reach the model.
+The identity is the model's name plus a hash of its config and weights, so a retrained or swapped model starts a
+fresh cache instead of being served the vectors of the previous one.'''
+
+# Files of a sentence transformer directory that decide its vectors
+MODEL_FILES = ("config.json", "sentence_bert_config.json", "modules.json", "1_Pooling/config.json",
+               "model.safetensors", "pytorch_model.bin")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_id, dim, cache_dir=EMBEDDING_CACHE_DIR):
+        self.dim = dim
+        self.dir = os.path.join(cache_dir, model_id.replace('/', '__'))
+        self.index_file = os.path.join(self.dir, 'index.txt')
+        self.vectors_file = os.path.join(self.dir, 'vectors.f32')
+        self.lock_file = os.path.join(self.dir, '.lock')
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.rows = {}
+        # Bytes of index.txt already read, a refresh only reads what was appended after them
+        self.index_offset = 0
+        self.num_rows = 0
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        with self._locked():
+            self._refresh()
+
+    def _locked(self):
+        return _FileLock(self.lock_file)
+
+    def _refresh(self):
+        """Pick up rows appended since the last read, including by other processes"""
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                f.seek(self.index_offset)
+                appended = f.read()
+            # Hashes are written whole lines at a time under the lock, a partial line can only be a crash leftover
+            complete = appended[:appended.rfind(b'\n') + 1]
+            if len(complete) < len(appended):
+                with open(self.index_file, 'r+b') as f:
+                    f.truncate(self.index_offset + len(complete))
+            self.index_offset += len(complete)
+            hashes = complete.decode('ascii').split()
+        else:
+            hashes = []
+
+        # Line n of the index is row n of the vectors
+        for digest in hashes:
+            self.rows[digest] = self.num_rows
+            self.num_rows += 1
+        num_rows = self.num_rows
+
+        # Vectors are written before their hashes, so extra rows can only come from an interrupted write
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        if size > num_rows * row_bytes:
+            with open(self.vectors_file, 'r+b') as f:
+                f.truncate(num_rows * row_bytes)
+
+        if hashes:
+            self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(num_rows, self.dim))
+
+    def __contains__(self, digest):
+        return digest in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, digests):
+        return np.asarray(self.vectors[[self.rows[d] for d in digests]])
+
+    def add(self, digests, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        with self._locked():
+            self._refresh()
+            new = [i for i, d in enumerate(digests) if d not in self.rows]
+            if not new:
+                return
+
+            with open(self.vectors_file, 'ab') as f:
+                f.write(vectors[new].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{digests[i]}\n" for i in new))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._refresh()
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'w')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+@functools.lru_cache(maxsize=8)
+def model_cache_id(model_dir, *extra_files):
+    """Cache identity of a local model directory, extra_files are weights outside MODEL_FILES (e.g. an ONNX export)"""
+    digest = hashlib.sha256()
+    for name in MODEL_FILES + extra_files:
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
+            continue
+        digest.update(name.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+    return f"{os.path.basename(os.path.normpath(model_dir))}-{digest.hexdigest()[:16]}"
+
+
+def default_model_id(model):
+    """Identity of a SentenceTransformer loaded by name, from its transformer config"""
+    try:
+        config = model[0].auto_model.config
+    except (TypeError, AttributeError, IndexError, KeyError):
+        return EMBEDDING_MODEL_ID
+
+    digest = hashlib.sha256(config.to_json_string().encode('utf-8')).hexdigest()[:16]
+    return f"{os.path.basename(os.path.normpath(config._name_or_path))}-{digest}"
+
+
+_caches = {}
+
+def cache_for(model, model_id=None):
+    # Encoders loaded from a local directory (ST_filter_data.load_encoder, OnnxEncoder) carry their own identity
+    model_id = model_id or getattr(model, 'cache_model_id', None) or default_model_id(model)
+    if model_id not in _caches:
+        _caches[model_id] = EmbeddingCache(model_id, model.get_sentence_embedding_dimension())
+    return _caches[model_id]
+
+
+def encode_cached(model, texts, cache=None, batch_size=EMBED_BATCH_SIZE):
+    """model.encode(texts) that only runs the model on texts the cache has not seen"""
+    if cache is None:
+        cache = cache_for(model)
+    digests = [text_hash(text) for text in texts]
+
+    hits = 0
+    missing = {}
+    for digest, text in zip(digests, texts):
+        if digest in cache:
+            hits += 1
+        elif digest not in missing:
+            missing[digest] = text
+
+    if missing:
+        embeddings = model.encode(list(missing.values()), batch_size=batch_size)
+        cache.add(list(missing.keys()), embeddings)
+
+    print(f"Embedding cache: {hits}/{len(texts)} hits, {len(missing)} texts encoded")
+
+    if not digests:
+        return np.empty((0, cache.dim), dtype=np.float32)
+    return cache.get(digests)
@@ -3,8 +3,14 @@ import aiohttp
 import random
 import asyncio
 import json
-from shared_utils import saveJSON, log_error, HEADERS, TEST_MODE, ERROR_RATE
+from shared_utils import JSONLWriter, JSONLDataset, readJSONL, log_error, HEADERS, TEST_MODE, ERROR_RATE, FETCH_MODE, GRAPHQL_BATCH_SIZE, REPO_CONCURRENCY, INCREMENTAL_EXTRACTION
+from rate_limiter import github_limiter
+from http_cache import cached_get
+from watermarks import WatermarkStore
+from blob_store import store_diff
+from diff_estimator import DiffSizeEstimator
 import os
+import inspect
 
 ''' Look for Pull Requests that specifically have comments, this is a pivot from the original idea of just taking the most recent prs and filtering them
 since many of the new prs(up to 100, when I tested) had no comments'''
@@ -17,38 +23,79 @@ def getRepos():
 
 
 
-async def searchPRsWithComments(session, repo_fullName, max_prs=50):
+# GitHub returns at most 100 items per page, larger pages mean fewer requests per PR
+PER_PAGE = 100
+
+# processSinglePR keeps a PR only with more than this many quality comments
+MIN_QUALITY_COMMENTS = 10
+
+
+def parseNextLink(link_header):
+  """Pull the rel="next" URL out of a Link header, None on the last page"""
+  if not link_header:
+    return None
+
+  for part in link_header.split(','):
+    url, _, rel = part.partition(';')
+    if 'rel="next"' in rel:
+      return url.strip().strip('<>')
+
+  return None
+
+
+
+async def iterPages(session, url, headers, pool, params=None):
+  """Async generator over every page of a paginated endpoint, following Link: rel=next"""
+  while url:
+    status, body, response_headers = await cached_get(session, url, headers, pool, params=params)
+    if status != 200:
+      print(f"Error fetching page {url}: {status}")
+      return
+
+    yield body
+
+    # The next link already carries the query string
+    url = parseNextLink(response_headers.get('Link'))
+    params = None
+
+
+
+async def searchPRsWithComments(session, repo_fullName, max_prs=50, updated_since=None, oldest_first=False):
     try:
       if TEST_MODE and random.random() < ERROR_RATE:
         raise aiohttp.ClientError("Simulated network timeout")
 
       search_url = "https://api.github.com/search/issues"
 
-      await asyncio.sleep(2.5)
-
       # Search for PRs with comments in this specific repo
       query = f"repo:{repo_fullName} type:pr comments:>0"
+      if updated_since:
+        # Only PRs that changed after the last run's watermark
+        query += f" updated:>{updated_since}"
 
       params = {
           'q': query,
           'sort': 'comments',     # Sort by number of comments
           'order': 'desc',        # Most comments first
-          'per_page': max_prs
+          'per_page': min(max_prs, PER_PAGE)
       }
+      if oldest_first:
+        # Incremental runs walk PRs in update order, so whatever was looked at is a prefix the watermark can pass
+        params['sort'] = 'updated'
+        params['order'] = 'asc'
 
       try:
-        async with session.get(search_url, headers=HEADERS, params=params) as response:
-            if response.status != 200:
-              print(f"Error searching PRs for {repo_fullName}: {response.status}")
-              return []
-            
-            data = await response.json()
-            prs = data.get("items", [])
-
-            for pr in prs:
-              pr['repository_full_name'] = repo_fullName
-
-            return prs
+        prs = []
+        async for data in iterPages(session, search_url, HEADERS, 'search', params=params):
+          prs.extend(data.get("items", []))
+          if len(prs) >= max_prs:
+            break
+
+        prs = prs[:max_prs]
+        for pr in prs:
+          pr['repository_full_name'] = repo_fullName
+
+        return prs
       except Exception as e:
         print(f"Error fetching PRs for {repo_fullName}: {e}")
         return []
@@ -95,8 +142,8 @@ def filterPRs(prs, repo_fullName):
 
 
 
-#Get the comments from the chosen quality PRs
-async def getComments(session, repo_fullName, pr_number):
+#Stream the comments of a PR one page at a time
+async def iterCommentPages(session, repo_fullName, pr_number):
 
   try:
     if TEST_MODE and random.random() < 0.1:
@@ -105,16 +152,10 @@ async def getComments(session, repo_fullName, pr_number):
     url = f"https://api.github.com/repos/{repo_fullName}/issues/{pr_number}/comments"
 
     try:
-      async with session.get(url, headers=HEADERS) as response:
-          if response.status != 200:
-            print(f"Error searching PRs for {repo_fullName}: {response.status}")
-            return []
-          
-          comments = await response.json()
-          return comments
+      async for page in iterPages(session, url, HEADERS, 'core', params={'per_page': PER_PAGE}):
+        yield page
     except Exception as e:
       print(f"Error fetching comments for PR #{pr_number}: {e}")
-      return []
   except Exception as e:
      log_error("api_failure", "getComments", {
         "repo": repo_fullName,
@@ -122,8 +163,41 @@ async def getComments(session, repo_fullName, pr_number):
         "error": str(e),
         "simulated": TEST_MODE
      })
-     return []
-  
+
+
+
+async def iterComments(session, repo_fullName, pr_number):
+  async for page in iterCommentPages(session, repo_fullName, pr_number):
+    for comment in page:
+      yield comment
+
+
+
+#Get the comments from the chosen quality PRs
+async def getComments(session, repo_fullName, pr_number):
+  return [comment async for comment in iterComments(session, repo_fullName, pr_number)]
+
+
+
+async def getPRMetadata(session, repo_fullName, pr_number):
+  """Size fields from the pulls endpoint, used to decide whether the diff is worth downloading"""
+  url = f"https://api.github.com/repos/{repo_fullName}/pulls/{pr_number}"
+
+  try:
+    status, pull, _ = await cached_get(session, url, HEADERS, 'core')
+    if status != 200:
+      print(f"Error getting PR metadata for PR #{pr_number}: {status}")
+      return {}
+
+    return {
+      'additions': pull.get('additions'),
+      'deletions': pull.get('deletions'),
+      'changed_files': pull.get('changed_files')
+    }
+  except Exception as e:
+    print(f"Error fetching metadata for PR #{pr_number}: {e}")
+    return {}
+
 
 
 async def getDiff(session, repo_fullName, pr_number):
@@ -140,12 +214,12 @@ async def getDiff(session, repo_fullName, pr_number):
         }
 
         try:
-            async with session.get(url, headers=diff_headers) as response:
-                if response.status != 200:
-                    print(f"Error getting PR diff for PR #{pr_number}: {response.status}")
-                    return None
+            status, codeDiff, _ = await cached_get(session, url, diff_headers, 'core', as_text=True)
+            if status != 200:
+                print(f"Error getting PR diff for PR #{pr_number}: {status}")
+                return None
 
-                return await response.text()
+            return codeDiff
 
         except Exception as e:
             print(f"Error fetching diff for PR #{pr_number}: {e}")
@@ -160,8 +234,186 @@ async def getDiff(session, repo_fullName, pr_number):
 
 
 
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+GRAPHQL_COMMENT_FIELDS = "pageInfo { hasNextPage endCursor } nodes { body author { login __typename } }"
+
+GRAPHQL_THREAD_FIELDS = f"""pageInfo {{ hasNextPage endCursor }}
+        nodes {{
+          id
+          comments(first: 20) {{ {GRAPHQL_COMMENT_FIELDS} }}
+        }}"""
+
+GRAPHQL_PR_FIELDS = f"""
+      number
+      title
+      body
+      isDraft
+      additions
+      deletions
+      changedFiles
+      comments(first: 100) {{ {GRAPHQL_COMMENT_FIELDS} }}
+      reviewThreads(first: 50) {{
+        {GRAPHQL_THREAD_FIELDS}
+      }}
+"""
+
+
+def buildPRQuery(repo_fullName, pr_numbers):
+  """Build one aliased query (pr123: pullRequest(number: 123) ...) for a batch of PRs"""
+  owner, name = repo_fullName.split('/', 1)
+
+  aliases = '\n'.join(
+    f"    pr{number}: pullRequest(number: {number}) {{{GRAPHQL_PR_FIELDS}    }}"
+    for number in pr_numbers
+  )
+
+  # rateLimit.cost is what the query actually charged, in points
+  return f"query {{\n  rateLimit {{ cost }}\n  repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{\n{aliases}\n  }}\n}}"
+
+
+# Follow-up queries for PRs whose comments or review threads did not fit in the first page
+MORE_COMMENTS_QUERY = f"""query($owner: String!, $name: String!, $number: Int!, $cursor: String) {{
+  rateLimit {{ cost }}
+  repository(owner: $owner, name: $name) {{
+    pullRequest(number: $number) {{ comments(first: 100, after: $cursor) {{ {GRAPHQL_COMMENT_FIELDS} }} }}
+  }}
+}}"""
+
+MORE_THREADS_QUERY = f"""query($owner: String!, $name: String!, $number: Int!, $cursor: String) {{
+  rateLimit {{ cost }}
+  repository(owner: $owner, name: $name) {{
+    pullRequest(number: $number) {{ reviewThreads(first: 50, after: $cursor) {{ {GRAPHQL_THREAD_FIELDS} }} }}
+  }}
+}}"""
+
+MORE_THREAD_COMMENTS_QUERY = f"""query($id: ID!, $cursor: String) {{
+  rateLimit {{ cost }}
+  node(id: $id) {{
+    ... on PullRequestReviewThread {{ comments(first: 100, after: $cursor) {{ {GRAPHQL_COMMENT_FIELDS} }} }}
+  }}
+}}"""
+
+
+# GraphQL comment nodes are reshaped to look like the REST issue comments processComments expects
+def graphqlCommentToRest(node):
+  author = node.get('author') or {}
+  return {
+    'user': {
+      'login': author.get('login', 'ghost'),
+      'type': 'Bot' if author.get('__typename') == 'Bot' else 'User'
+    },
+    'body': node.get('body') or ''
+  }
+
+
+async def postGraphQL(session, payload):
+  """One GraphQL request through the rate limiter, returns the data object (None on a failed request)"""
+  await github_limiter.acquire('graphql')
+  async with session.post(GRAPHQL_URL, headers=HEADERS, json=payload) as response:
+      error_body = await response.text() if response.status in (403, 429) else None
+      github_limiter.observe('graphql', response, error_body)
+      if response.status != 200:
+        raise aiohttp.ClientError(f"GraphQL request failed with status {response.status}")
+
+      data = await response.json()
+
+  # acquire took one point, charge the rest of the query's cost
+  cost = ((data.get('data') or {}).get('rateLimit') or {}).get('cost', 1)
+  if cost > 1:
+    github_limiter.charge('graphql', cost - 1)
+
+  if data.get('errors'):
+    print(f"GraphQL errors: {data['errors'][0].get('message')}")
+  return data.get('data') or {}
+
+
+async def followConnection(session, connection, query, variables, path):
+  """Every node of a connection, requesting the pages after the first one until hasNextPage is false"""
+  nodes = list(connection['nodes'])
+  page_info = connection['pageInfo']
+
+  while page_info['hasNextPage']:
+    data = await postGraphQL(session, {'query': query, 'variables': {**variables, 'cursor': page_info['endCursor']}})
+    for key in path:
+      data = (data or {}).get(key)
+    if not data:
+      raise aiohttp.ClientError("GraphQL page missing from the response")
+
+    nodes.extend(data['nodes'])
+    page_info = data['pageInfo']
+
+  return nodes
+
+
+async def collectGraphQLComments(session, repo_fullName, node):
+  """PR comments followed by review thread comments, with every page of each, like REST mode pages through them"""
+  owner, name = repo_fullName.split('/', 1)
+  pr_variables = {'owner': owner, 'name': name, 'number': node['number']}
+
+  comment_nodes = await followConnection(session, node['comments'], MORE_COMMENTS_QUERY, pr_variables,
+                                         ('repository', 'pullRequest', 'comments'))
+  threads = await followConnection(session, node['reviewThreads'], MORE_THREADS_QUERY, pr_variables,
+                                   ('repository', 'pullRequest', 'reviewThreads'))
+  for thread in threads:
+    comment_nodes.extend(await followConnection(session, thread['comments'], MORE_THREAD_COMMENTS_QUERY,
+                                                {'id': thread['id']}, ('node', 'comments')))
+
+  return [graphqlCommentToRest(c) for c in comment_nodes]
+
+
+async def getPRsGraphQL(session, repo_fullName, pr_numbers):
+  """Fetch comments, review thread comments and size metadata for several PRs in one request.
+  PRs over the first page of comments or threads get follow-up requests for the rest"""
+
+  try:
+    if TEST_MODE and random.random() < ERROR_RATE:
+      raise aiohttp.ClientError("Simulated network timeout")
+
+    try:
+      data = await postGraphQL(session, {'query': buildPRQuery(repo_fullName, pr_numbers)})
+    except Exception as e:
+      print(f"Error fetching GraphQL batch for {repo_fullName}: {e}")
+      return {}
+
+    repository = data.get('repository') or {}
+
+    results = {}
+    for node in repository.values():
+      if not node:
+        continue
+
+      # A PR whose remaining pages fail is left out, processPR then fetches it through REST
+      try:
+        comments = await collectGraphQLComments(session, repo_fullName, node)
+      except Exception as e:
+        print(f"Error paging GraphQL comments of PR #{node['number']}: {e}")
+        continue
+
+      results[node['number']] = {
+        'comments': comments,
+        'title': node.get('title'),
+        'body': node.get('body'),
+        'draft': node.get('isDraft', False),
+        'additions': node.get('additions', 0),
+        'deletions': node.get('deletions', 0),
+        'changed_files': node.get('changedFiles', 0)
+      }
+
+    return results
+  except Exception as e:
+    log_error("api_failure", "getPRsGraphQL", {
+      "repo": repo_fullName,
+      "pr_numbers": pr_numbers,
+      "error": str(e),
+      "simulated": TEST_MODE
+    })
+    return {}
+
+
+
 #Filter out comments with patterns of botting and non-substantial info
-def processComments(comments, pr_data, codeDiff):
+def filterComments(comments):
 
   bot_patterns = [
       'bot', 'Bot', '[bot]', 'github-actions', 'dependabot',
@@ -213,6 +465,11 @@ def processComments(comments, pr_data, codeDiff):
           
     #quality_comments.append(body)
 
+  return quality_comments
+
+
+
+def buildDiscussion(quality_comments, pr_data, diff_fields):
   cleaned_comment = {
                 'index': None,
                 'repository': pr_data.get('repository_full_name', 'Unknown'),
@@ -221,28 +478,92 @@ def processComments(comments, pr_data, codeDiff):
                 'pr_number': pr_data.get('number', 0),
                 'comments': quality_comments,
                 'num_comments': len(quality_comments),
-                'diff': codeDiff,
-                'diff_length': len(codeDiff)
+                **diff_fields
   }
 
   return cleaned_comment
-  
 
 
-async def processPR(session, repo_fullName, prs, semaphore):
-   """Process multiple PRs concurrently with rate limiting"""
-   async def processSinglePR(pr):
+
+def processComments(comments, pr_data, codeDiff):
+  return buildDiscussion(filterComments(comments), pr_data, store_diff(codeDiff))
+
+
+
+async def streamQualityComments(session, repo_fullName, pr_number, stop_after=None):
+  """Filter comments as pages arrive, no more pages are requested once more than stop_after have passed"""
+  quality_comments = []
+
+  async for page in iterCommentPages(session, repo_fullName, pr_number):
+    quality_comments.extend(filterComments(page))
+
+    if stop_after is not None and len(quality_comments) > stop_after:
+      break
+
+  return quality_comments
+
+
+
+async def prefetchGraphQL(session, repo_fullName, prs, semaphore):
+   """Fetch every PR of a repo through batched GraphQL queries, keyed by PR number"""
+   pr_numbers = [pr['number'] for pr in prs]
+   batches = [pr_numbers[i:i + GRAPHQL_BATCH_SIZE] for i in range(0, len(pr_numbers), GRAPHQL_BATCH_SIZE)]
+
+   async def fetchBatch(batch):
       async with semaphore:
-        pr_number = pr['number']
+        return await getPRsGraphQL(session, repo_fullName, batch)
+
+   prefetched = {}
+   for batch_result in await asyncio.gather(*[fetchBatch(batch) for batch in batches]):
+      prefetched.update(batch_result)
 
-        comment_task = getComments(session, repo_fullName, pr_number)
-        diff_task = getDiff(session, repo_fullName, pr_number)
+   print(f"   GraphQL fetched {len(prefetched)}/{len(pr_numbers)} PRs in {len(batches)} requests")
+   return prefetched
 
-        comments, codeDiff = await asyncio.gather(comment_task, diff_task)
 
-        quality_comments = processComments(comments, pr, codeDiff)
 
-        return quality_comments if quality_comments['num_comments'] > 10 else None
+async def processPR(session, repo_fullName, prs, semaphore, fetch_mode=FETCH_MODE, discussion_callback=None, estimator=None):
+   """Process multiple PRs concurrently with rate limiting"""
+   prefetched = {}
+   if fetch_mode == "graphql":
+      prefetched = await prefetchGraphQL(session, repo_fullName, prs, semaphore)
+
+   async def processSinglePR(pr):
+      async with semaphore:
+        pr_number = pr['number']
+
+        if pr_number in prefetched:
+          # Comments and metadata came with the batch, only the diff is left to download
+          graphql_pr = prefetched[pr_number]
+          pr.update({key: value for key, value in graphql_pr.items() if key != 'comments'})
+          quality_comments = filterComments(graphql_pr['comments'])
+        else:
+          quality_comments = await streamQualityComments(session, repo_fullName, pr_number, stop_after=MIN_QUALITY_COMMENTS)
+
+        # Metadata and diffs wait until the PR is known to be kept, most PRs stop here
+        if len(quality_comments) <= MIN_QUALITY_COMMENTS:
+          return None
+
+        if estimator and pr_number not in prefetched:
+          pr.update(await getPRMetadata(session, repo_fullName, pr_number))
+
+        if estimator and not estimator.should_download(pr):
+          print(f"   Skipped diff of PR #{pr_number}: predicted length outside the critique window")
+          return None
+
+        codeDiff = await getDiff(session, repo_fullName, pr_number)
+        if estimator and codeDiff:
+          estimator.record(pr, len(codeDiff))
+
+        # Compressing a large diff takes long enough to stall every other fetch, so it runs on a thread
+        discussion = buildDiscussion(quality_comments, pr, await asyncio.to_thread(store_diff, codeDiff))
+
+        if discussion_callback:
+          # The callback may be a coroutine, e.g. a bounded queue's put, which makes extraction wait for the consumer
+          result = discussion_callback(discussion)
+          if inspect.isawaitable(result):
+            await result
+        return discussion
    tasks = [processSinglePR(pr) for pr in prs]
    results =  await asyncio.gather(*tasks, return_exceptions=True)
 
@@ -252,57 +573,133 @@ async def processPR(session, repo_fullName, prs, semaphore):
 
 
 
-async def prDiscussionExtraction(repos, iteration=0, checkpoint_callback=None, start_repo=0):
-    print("=== STAGE 2: PR DISCUSSION EXTRACTION ===")
+def prepareDiscussionFile(pr_file, kept_repos):
+    """Drop records of repos that were not checkpointed, they get reprocessed on resume"""
+    if not kept_repos or not os.path.exists(pr_file):
+      open(pr_file, 'w').close()
+      return 0
+
+    kept = [d for d in readJSONL(pr_file) if d['repository'] in kept_repos]
+    with JSONLWriter(pr_file, mode='w') as writer:
+      for index, discussion in enumerate(kept, 1):
+        discussion['index'] = index
+        writer.write(discussion)
+
+    return len(kept)
+
 
-    all_discussions = []
 
+async def prDiscussionExtraction(repos, iteration=0, checkpoint_callback=None, start_repo=0, fetch_mode=FETCH_MODE, repo_concurrency=REPO_CONCURRENCY, incremental=INCREMENTAL_EXTRACTION, discussion_callback=None):
+    print("=== STAGE 2: PR DISCUSSION EXTRACTION ===")
+
+    # Global cap on in-flight PR requests, shared by every repo worker
     semaphore = asyncio.Semaphore(15)
-    index = 1
+    repo_slots = asyncio.Semaphore(repo_concurrency)
     num_repo = 6 #change to 40
     pr_per = 10 #change to 60
 
-    async with aiohttp.ClientSession() as session:
-
-       for i, repo in enumerate(repos[:num_repo]):
-          if i < start_repo:
-            print(f"⏭️ Skipping repo {i+1}/{num_repo}: {repo['full_name']} (already completed)")
-            continue
+    selected_repos = repos[:num_repo]
+    finished_repos = set()
+    checkpointed = start_repo
+    watermarks = WatermarkStore() if incremental else None
+    processed_prs = {}
+    estimator = DiffSizeEstimator()
+
+    # Discussions are appended to the iteration file as soon as each PR is processed
+    pr_dir = "../../data/iterations/pr"
+    os.makedirs(pr_dir, exist_ok=True)
+    pr_file = f'{pr_dir}/prs_iter{iteration}.jsonl'
+    index = prepareDiscussionFile(pr_file, {repo['full_name'] for repo in selected_repos[:start_repo]}) + 1
+    writer = JSONLWriter(pr_file)
+
+    async def handOn(discussion):
+       if discussion_callback:
+          result = discussion_callback(discussion)
+          if inspect.isawaitable(result):
+             await result
+
+    # Discussions kept from before a resume are handed on like fresh ones
+    if discussion_callback:
+       for discussion in readJSONL(pr_file):
+          await handOn(discussion)
+
+    async def writeDiscussion(discussion):
+       nonlocal index
+       discussion['index'] = index
+       index += 1
+       writer.write(discussion)
+       await handOn(discussion)
+
+    def recordCompletion(i):
+       nonlocal checkpointed
+       finished_repos.add(i)
+
+       # Repos finish out of order, but resuming skips the first completed_repos repos,
+       # so the checkpoint only advances over the contiguous prefix of finished repos
+       previous = checkpointed
+       while checkpointed in finished_repos:
+          if watermarks:
+             watermarks.advance(selected_repos[checkpointed]['full_name'], processed_prs.pop(checkpointed))
+          checkpointed += 1
+
+       if checkpointed > previous:
+          # Watermarks only cover checkpointed repos, the others are redone on resume
+          if watermarks:
+             watermarks.save()
+          if checkpoint_callback:
+             last_completed_repo = selected_repos[checkpointed - 1]['full_name']
+             checkpoint_callback(iteration, checkpointed, last_completed_repo)
+             print(f"✅ Checkpoint saved: {checkpointed}/{num_repo} repos completed")
 
+    async def processRepo(session, i, repo):
+       async with repo_slots:
           print(f"\n🔄 Processing repo {i+1}/{num_repo}: { repo['full_name']}")
 
           # Search for PRs
-          prs = await searchPRsWithComments(session, repo['full_name'], max_prs=100)
+          updated_since = watermarks.get(repo['full_name']) if watermarks else None
+          if updated_since:
+            print(f"   Searching PRs updated since {updated_since}")
+          prs = await searchPRsWithComments(session, repo['full_name'], max_prs=100, updated_since=updated_since,
+                                            oldest_first=watermarks is not None)
           print(f"   Total PRs found: {len(prs)} PRs")
 
           # Filter PRs
-          substantial_prs = filterPRs(prs, repo['full_name'])[:pr_per]
+          substantial_prs = filterPRs(prs, repo['full_name'])
+          consumed_prs = prs
+          if len(substantial_prs) > pr_per:
+            # PRs after the last one processed were never looked at, the watermark must stop before them
+            last_processed = substantial_prs[pr_per - 1]
+            consumed_prs = prs[:next(j for j, pr in enumerate(prs) if pr is last_processed) + 1]
+            substantial_prs = substantial_prs[:pr_per]
           print(f"   Found {len(substantial_prs)} substantial PRs")
 
           if substantial_prs:
-            repo_discussions = await processPR(session, repo['full_name'], substantial_prs, semaphore)
+            await processPR(session, repo['full_name'], substantial_prs, semaphore, fetch_mode, discussion_callback=writeDiscussion, estimator=estimator)
 
-            all_discussions.extend(repo_discussions)
+          processed_prs[i] = consumed_prs
+          recordCompletion(i)
 
-          if checkpoint_callback:
-             last_completed_repo = repo['full_name']   
-             checkpoint_callback(iteration, i + 1, last_completed_repo)
-             print(f"✅ Checkpoint saved: {i + 1}/{num_repo} repos completed")
-                    
-
-    print(f"\n Total quality discussions collected: {len(all_discussions)}")
-    
-    if all_discussions:
-
-      for discussion in all_discussions:
-        if discussion:  
-          discussion['index'] = index 
-          index += 1  
-      pr_dir = "../../data/iterations/pr"
-      os.makedirs(pr_dir, exist_ok=True)
-      saveJSON(all_discussions, f'{pr_dir}/prs_iter{iteration}.json')
-
-    return all_discussions
+    try:
+       async with aiohttp.ClientSession() as session:
+
+          for i, repo in enumerate(selected_repos[:start_repo]):
+             print(f"⏭️ Skipping repo {i+1}/{num_repo}: {repo['full_name']} (already completed)")
+
+          # A failing repo cancels the others, like the sequential loop stopping at the first error
+          try:
+             async with asyncio.TaskGroup() as group:
+                for i, repo in enumerate(selected_repos):
+                   if i >= start_repo:
+                      group.create_task(processRepo(session, i, repo))
+          except ExceptionGroup as errors:
+             # The first failure is what callers log, the group keeps the rest in the traceback
+             raise errors.exceptions[0] from errors
+    finally:
+       writer.close()
+
+    print(f"\n Total quality discussions collected: {index - 1}")
+
+    return JSONLDataset(pr_file)
   
 
 
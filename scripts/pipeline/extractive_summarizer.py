@@ -0,0 +1,82 @@
+import re
+
+import numpy as np
+
+from shared_utils import EXTRACTIVE_MIN_WORDS, EXTRACTIVE_MAX_WORDS
+from embedding_cache import encode_cached
+
+''' Local stand-in for the LLM summary: picks the most central sentences of a discussion (LexRank over MiniLM
+sentence embeddings, shared with ST_filter_data through the embedding cache) until the same 100-120 word budget as
+the OpenAI prompt is filled, and returns them in their original order. Runs in the worker processes of
+summarize_comments.ExtractiveSummarizer, each of which loads the encoder once.'''
+
+# Sentences shorter than this are mostly "LGTM", "Thanks!" or leftovers of code blocks
+MIN_SENTENCE_WORDS = 4
+# A candidate this similar to a sentence already picked adds nothing
+REDUNDANCY_THRESHOLD = 0.9
+
+_encoder = None
+
+
+def init_worker():
+    global _encoder
+    from ST_filter_data import load_encoder
+    _encoder = load_encoder()
+
+
+def split_sentences(text):
+    # Drop fenced code, keep the prose around it
+    text = re.sub(r"```.*?```", " ", text, flags=re.DOTALL)
+    sentences = []
+    for line in text.split("\n"):
+        for sentence in re.split(r"(?<=[.!?])\s+", line.strip()):
+            sentence = sentence.strip(" -*>#\t")
+            if len(sentence.split()) >= MIN_SENTENCE_WORDS:
+                sentences.append(sentence)
+    return sentences
+
+
+def centrality(embeddings, damping=0.85, iterations=30):
+    """LexRank scores: stationary distribution of a random walk over the cosine similarity graph"""
+    similarity = np.clip(embeddings @ embeddings.T, 0, None)
+    np.fill_diagonal(similarity, 0)
+    transition = similarity / np.clip(similarity.sum(axis=1, keepdims=True), 1e-12, None)
+
+    n = len(embeddings)
+    scores = np.full(n, 1 / n)
+    for _ in range(iterations):
+        scores = (1 - damping) / n + damping * (transition.T @ scores)
+    return scores
+
+
+def summarize(text, min_words=EXTRACTIVE_MIN_WORDS, max_words=EXTRACTIVE_MAX_WORDS):
+    sentences = split_sentences(text)
+    if not sentences:
+        return " ".join(text.split()[:max_words])
+    if sum(len(s.split()) for s in sentences) <= max_words:
+        return " ".join(sentences)
+
+    embeddings = np.asarray(encode_cached(_encoder, sentences), dtype=np.float32)
+    embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+    picked = []
+    num_words = 0
+    for i in np.argsort(-centrality(embeddings)):
+        if num_words >= min_words:
+            break
+
+        words = len(sentences[i].split())
+        if num_words + words > max_words:
+            continue
+        if picked and (embeddings[picked] @ embeddings[i]).max() >= REDUNDANCY_THRESHOLD:
+            continue
+
+        picked.append(i)
+        num_words += words
+
+    # Every sentence is over the budget on its own, cut the most central one
+    if not picked:
+        top = int(np.argmax(centrality(embeddings)))
+        return " ".join(sentences[top].split()[:max_words])
+
+    return " ".join(sentences[i] for i in sorted(picked))
@@ -1,6 +1,8 @@
 import json
 import re
 
+from blob_store import diff_fields
+
 # Filter out codediffs not in bounds 5000-80000 characters
 
 async def getCodeDiff(filtered_data):
@@ -9,7 +11,7 @@ async def getCodeDiff(filtered_data):
     for i, item in enumerate(filtered_data, 1):
         codeDiff_list.append({
             "index": i,
-            "diff": item.get("diff", ""),
+            **diff_fields(item)
         })
     
     return codeDiff_list
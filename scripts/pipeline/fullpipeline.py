@@ -4,12 +4,14 @@ import os
 from datetime import datetime
 
 from extract_prs import prDiscussionExtraction
-from ST_filter_data import filter_comments as st_filter
-from summarize_comments import process_comments_concurrently as summarize
+from ST_filter_data import FilterWorker
+from summarize_comments import process_comments_concurrently
+from summarize_batch import process_comments_batch
 from filter_codediff import getCodeDiff
 from transform_critique_data import get_model_data as transform_critique
+from streaming import stream_iteration
 
-from shared_utils import TEST_MODE, log_error
+from shared_utils import TEST_MODE, SUMMARY_MODE, SUMMARIZER_BACKEND, PIPELINE_MODE, log_error
 import random
 
 input_file = '../../data/pipeline/1_quality_repos.json'
@@ -93,20 +95,19 @@ def get_resume_point():
                 return iteration, checkpoint['completed_repos']
     return latest_completed + 1, 0
 
-async def run_iteration(iteration, start_repo):
-
-
-    # Step 1: PR Discussion Extraction
-    print(f"\n=== STARTING ITERATION {iteration} ===")
-    repo_batch = load_repo_batch(iteration)
+async def run_stages(iteration, repo_batch, start_repo):
+    # Step 2 runs alongside step 1: each extracted PR is queued for the sentence transformer right away
+    filter_worker = FilterWorker()
     try:
         discussions = await prDiscussionExtraction(
             repo_batch,
             iteration,
             checkpoint_callback=save_checkpoint,
-            start_repo=start_repo
+            start_repo=start_repo,
+            discussion_callback=filter_worker.submit
         )
     except Exception as e:
+        filter_worker.cancel()
         log_error("pipeline_failure", "prDiscussionExtraction", {
             "iteration": iteration,
             "error": str(e)
@@ -116,7 +117,7 @@ async def run_iteration(iteration, start_repo):
     print(f"\n=== FILTERING DATA ===")
 
     try:
-        filtered_data  = await st_filter(discussions)
+        filtered_data  = await filter_worker.finish()
     except Exception as e:
         log_error("pipeline_failure", "st_filter", {
             "iteration": iteration,
@@ -129,8 +130,13 @@ async def run_iteration(iteration, start_repo):
     print(f"PARALLEL PROCESSING")
 
     try:
+        if SUMMARY_MODE == "batch" and SUMMARIZER_BACKEND == "openai":
+            summarize = process_comments_batch(filtered_data)
+        else:
+            summarize = process_comments_concurrently(filtered_data)
+
         summarized_comments, filtered_codediff = await asyncio.gather(
-            summarize(filtered_data, semaphore_limit=5),
+            summarize,
             getCodeDiff(filtered_data)
         )
     except Exception as e:
@@ -150,21 +156,44 @@ async def run_iteration(iteration, start_repo):
             "iteration": iteration,
             "error": str(e)
         }, iteration)
+        raise
+
+    return critique_data
+
+async def run_iteration(iteration, start_repo):
+
 
+    # Step 1: PR Discussion Extraction
+    print(f"\n=== STARTING ITERATION {iteration} ===")
+    repo_batch = load_repo_batch(iteration)
     output_file =  f'{critique_dir}/critique_data_iter{iteration}.json'
 
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(critique_data, f, indent=2)
-    except Exception as e:
-        log_error("io_failure", "save_critique_data", {
-            "iteration": iteration,
-            "output_file": output_file,
-            "error": str(e)
-        }, iteration)
-        raise
+    if PIPELINE_MODE == "streaming":
+        # Records are written to output_file as the stream finishes, never held in memory together
+        try:
+            num_records = await stream_iteration(repo_batch, iteration, output_file, save_checkpoint, start_repo)
+        except Exception as e:
+            log_error("pipeline_failure", "stream_iteration", {
+                "iteration": iteration,
+                "error": str(e)
+            }, iteration)
+            raise
+    else:
+        critique_data = await run_stages(iteration, repo_batch, start_repo)
+        num_records = len(critique_data)
+
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(critique_data, f, indent=2)
+        except Exception as e:
+            log_error("io_failure", "save_critique_data", {
+                "iteration": iteration,
+                "output_file": output_file,
+                "error": str(e)
+            }, iteration)
+            raise
 
-    print(f"Saved {len(critique_data)} critique records to {output_file}")
+    print(f"Saved {num_records} critique records to {output_file}")
 
     print(f"\n === COMPLETED ITERATION {iteration} ===")
 
@@ -195,4 +224,6 @@ async def main():
             print(f"Sleeping for 1 hour before iteration {iteration + 1}...")
             await asyncio.sleep(10) #TEST change back to 3600
 
-asyncio.run(main())
\ No newline at end of file
+# The extractive summarizer's worker processes import this module, the pipeline only runs in the parent
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from blob_store import blob_store
+from rate_limiter import github_limiter
+from shared_utils import HTTP_CACHE_DIR, HTTP_CACHE_TTL
+
+''' Persistent cache for GitHub GET requests. Every response is stored with its ETag/Last-Modified, and the next
+request for the same URL and params is sent as a conditional request. GitHub answers 304 without charging the
+rate limit, so reruns after a crash or a filter change cost almost nothing. Entries younger than the TTL are
+served straight from disk without touching the network. Text bodies (diffs) go to the compressed blob store and the
+entry only keeps their digest, so the cache does not hold a second, uncompressed copy of every diff.'''
+
+# Response headers worth keeping with the body (Link is needed for pagination)
+KEPT_HEADERS = ['ETag', 'Last-Modified', 'Link']
+
+
+class HTTPCache:
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def key(self, url, params=None, accept=None):
+        raw = json.dumps([url, sorted((params or {}).items()), accept], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename so a crash never leaves a half written entry behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def body(self, entry):
+        # Blobs are compressed, (de)compression runs on a thread instead of the event loop
+        if entry.get('body_digest'):
+            return await asyncio.to_thread(blob_store.get, entry['body_digest'])
+        return entry['body']
+
+    def is_fresh(self, entry):
+        return self.ttl > 0 and time.time() - entry['fetched_at'] < self.ttl
+
+
+http_cache = HTTPCache()
+
+
+async def cached_get(session, url, headers, pool, params=None, as_text=False, cache=http_cache):
+    """GET through the rate limiter and the disk cache. Returns (status, body, kept response headers)"""
+    key = cache.key(url, params, headers.get('Accept'))
+    entry = cache.load(key)
+
+    if entry and cache.is_fresh(entry):
+        return 200, await cache.body(entry), entry['headers']
+
+    request_headers = dict(headers)
+    if entry:
+        if entry['headers'].get('ETag'):
+            request_headers['If-None-Match'] = entry['headers']['ETag']
+        if entry['headers'].get('Last-Modified'):
+            request_headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+    await github_limiter.acquire(pool)
+    async with session.get(url, headers=request_headers, params=params) as response:
+        error_body = await response.text() if response.status in (403, 429) else None
+        github_limiter.observe(pool, response, error_body)
+
+        if response.status == 304 and entry:
+            entry['fetched_at'] = time.time()
+            cache.save(key, entry)
+            return 200, await cache.body(entry), entry['headers']
+
+        kept_headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+
+        if response.status != 200:
+            return response.status, None, kept_headers
+
+        body = await response.text() if as_text else await response.json()
+
+    entry = {
+        'url': url,
+        'params': params,
+        'fetched_at': time.time(),
+        'headers': kept_headers
+    }
+    if as_text and body:
+        entry['body_digest'] = await asyncio.to_thread(blob_store.put, body)
+    else:
+        entry['body'] = body
+    cache.save(key, entry)
+
+    return 200, body, kept_headers
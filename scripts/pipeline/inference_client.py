@@ -0,0 +1,67 @@
+import json
+import socket
+
+import numpy as np
+
+from shared_utils import INFERENCE_SOCKET
+
+''' Client for inference_server.py. Requests and responses are one JSON object per line over a Unix socket:
+{"texts": [...]} -> {"labels": [...], "probs": [[...], ...]} or {"error": "..."}
+{"texts": [...], "return_embeddings": true} -> the same plus {"embeddings": [[...], ...]}
+{"texts": [...], "embed": true} -> {"embeddings": [[...], ...]}'''
+
+
+class InferenceClient:
+    def __init__(self, socket_path=INFERENCE_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rwb')
+
+    @classmethod
+    def connect(cls, socket_path=INFERENCE_SOCKET):
+        """Client for a running server, None when no server is listening"""
+        try:
+            return cls(socket_path)
+        except OSError:
+            return None
+
+    def _request(self, request):
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Inference server closed the connection")
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"Inference server error: {response['error']}")
+        return response
+
+    def classify(self, texts, return_embeddings=False):
+        """Returns (labels, probs) for a list of comments, plus their embeddings if asked"""
+        if not texts:
+            if return_embeddings:
+                return np.array([], dtype=int), np.empty((0, 2)), np.empty((0, 0), dtype=np.float32)
+            return np.array([], dtype=int), np.empty((0, 2))
+
+        response = self._request({'texts': list(texts), 'return_embeddings': return_embeddings})
+        labels, probs = np.array(response['labels']), np.array(response['probs'])
+        if return_embeddings:
+            return labels, probs, np.array(response['embeddings'], dtype=np.float32)
+        return labels, probs
+
+    def embed(self, texts):
+        """Sentence embeddings of a list of comments, one row per text"""
+        response = self._request({'texts': list(texts), 'embed': True})
+        return np.array(response['embeddings'], dtype=np.float32)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import time
+
+from shared_utils import INFERENCE_SOCKET, INFERENCE_BATCH_WINDOW, INFERENCE_MAX_BATCH
+from ST_filter_data import LocalClassifier
+from inference_client import InferenceClient
+
+''' Long-lived comment classifier. Loads the sentence transformer and best_classifier.pkl once and serves
+classify(texts) -> (labels, probs) over a Unix socket, so the pipeline, labeling tools and ad-hoc analysis share one
+warm model. Requests arriving within INFERENCE_BATCH_WINDOW seconds of each other are run as one micro-batch.
+
+Run from scripts/pipeline:  python inference_server.py
+Use from anywhere:          InferenceClient().classify(["This breaks on empty input..."])'''
+
+
+class MicroBatcher:
+    def __init__(self, classifier, window=INFERENCE_BATCH_WINDOW, max_batch=INFERENCE_MAX_BATCH):
+        self.classifier = classifier
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+
+    async def classify(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            requests = [await self.queue.get()]
+            num_texts = len(requests[0][0])
+
+            # Wait a few milliseconds for other callers to join the batch
+            deadline = loop.time() + self.window
+            while num_texts < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                num_texts += len(request[0])
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            start_time = time.perf_counter()
+            try:
+                labels, probs, embeddings = await loop.run_in_executor(None, self.classifier.classify, texts, True)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            print(f"Batch of {len(texts)} texts from {len(requests)} requests in {time.perf_counter() - start_time:.2f}s")
+
+            offset = 0
+            for request_texts, future in requests:
+                end = offset + len(request_texts)
+                future.set_result((labels[offset:end].tolist(), probs[offset:end].tolist(), embeddings[offset:end]))
+                offset = end
+
+
+async def serve(socket_path=INFERENCE_SOCKET):
+    if os.path.exists(socket_path):
+        client = InferenceClient.connect(socket_path)
+        if client:
+            client.close()
+            raise RuntimeError(f"An inference server is already listening on {socket_path}")
+        os.remove(socket_path)
+
+    print("Loading models...")
+    batcher = MicroBatcher(LocalClassifier())
+
+    async def handle(reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if request.get('embed'):
+                        # Embedding requests hit the cache filled by classification, so they skip the batcher
+                        embeddings = await asyncio.get_running_loop().run_in_executor(
+                            None, batcher.classifier.embed, request['texts'])
+                        response = {'embeddings': embeddings.tolist()}
+                    else:
+                        labels, probs, embeddings = await batcher.classify(request['texts'])
+                        response = {'labels': labels, 'probs': probs}
+                        if request.get('return_embeddings'):
+                            response['embeddings'] = embeddings.tolist()
+                except Exception as e:
+                    response = {'error': str(e)}
+
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    # Requests are single JSON lines and can carry thousands of comments
+    server = await asyncio.start_unix_server(handle, path=socket_path, limit=64 * 1024 * 1024)
+    print(f"Inference server listening on {socket_path}")
+
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), batcher.run())
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
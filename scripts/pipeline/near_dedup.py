@@ -0,0 +1,142 @@
+import hashlib
+import os
+import pickle
+import re
+import zlib
+
+import numpy as np
+
+from shared_utils import NEAR_DUP_DIR, NEAR_DUP_THRESHOLD
+
+''' MinHash signatures with an LSH band index, persisted across iterations. Used to drop near-identical comments
+(template replies, pasted CI notices) before embedding and near-identical discussions (the same PR mirrored across
+forks) before summarization. Entries are keyed by where the text came from (the PR, plus a hash of the normalized
+text for comments), and a PR's own entries are never candidates for it, so rerunning an iteration does not mark its
+comments as duplicates of the previous attempt even when comments were added or edited in between.'''
+
+# Signature hashes are (a * x + b) mod PRIME over 32 bit shingle hashes, which never overflows uint64
+PRIME = np.uint64(4294967291)
+SHINGLE_SIZE = 5
+
+
+class NearDuplicateIndex:
+    def __init__(self, name, threshold=NEAR_DUP_THRESHOLD, num_perm=128, bands=32, index_dir=NEAR_DUP_DIR):
+        # 32 bands of 4 rows puts the LSH candidate threshold around (1/32) ** (1/4), roughly 0.42,
+        # every candidate is then checked against the real threshold on the full signature
+        self.path = os.path.join(index_dir, f"{name}.pkl")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = np.random.RandomState(1)
+        self.a = rng.randint(1, int(PRIME), size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.b = rng.randint(0, int(PRIME), size=num_perm, dtype=np.int64).astype(np.uint64)
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            self.signatures, self.buckets = state["signatures"], state["buckets"]
+        else:
+            self.signatures = {}
+            self.buckets = [{} for _ in range(bands)]
+
+    def signature(self, text):
+        normalized = normalize(text)
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def similarity(self, signature, other):
+        return float((signature == other).mean())
+
+    def query(self, key, signature, exclude_prefix=None):
+        """Key of the most similar earlier entry at or above the threshold, None if there is none.
+        Entries whose key starts with exclude_prefix are not candidates"""
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        candidates.discard(key)
+        if exclude_prefix is not None:
+            candidates = {candidate for candidate in candidates if not candidate.startswith(exclude_prefix)}
+
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = self.similarity(self.signatures[candidate], signature)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, key, signature):
+        if key in self.signatures:
+            return
+        self.signatures[key] = signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(band_key, []).append(key)
+
+    def check_and_add(self, key, text):
+        """Returns the key this text duplicates, or None after adding it to the index"""
+        signature = self.signature(text)
+        duplicate_of = self.query(key, signature)
+        if duplicate_of is None:
+            self.add(key, signature)
+        return duplicate_of
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"signatures": self.signatures, "buckets": self.buckets}, f)
+        os.replace(tmp_path, self.path)
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+def drop_duplicate_comments(data, index):
+    """Remove comments that nearly match one seen earlier, in this PR or any earlier one"""
+    dropped = 0
+    for item in data:
+        owner = f"{item.get('repository')}#{item.get('pr_number')}"
+        kept = []
+        kept_signatures = []
+        for comment in item.get("comments", []):
+            key = f"{owner}:{hashlib.sha256(normalize(comment).encode('utf-8')).hexdigest()[:16]}"
+            signature = index.signature(comment)
+
+            # Index entries of this PR may be an earlier attempt at it, repeats within the PR are checked here instead
+            if index.query(key, signature, exclude_prefix=f"{owner}:") is not None:
+                continue
+            if any(index.similarity(signature, other) >= index.threshold for other in kept_signatures):
+                continue
+
+            index.add(key, signature)
+            kept.append(comment)
+            kept_signatures.append(signature)
+        dropped += len(item.get("comments", [])) - len(kept)
+        item["comments"] = kept
+
+    if dropped:
+        print(f"Dropped {dropped} near-duplicate comments")
+    return data
+
+
+def drop_duplicate_discussions(data, index):
+    """Remove discussions whose filtered comments nearly match an earlier discussion"""
+    kept = []
+    for item in data:
+        key = f"{item.get('repository')}#{item.get('pr_number')}"
+        duplicate_of = index.check_and_add(key, "\n".join(item.get("filtered_comments", [])))
+        if duplicate_of is None:
+            kept.append(item)
+        else:
+            print(f"!!! REMOVED {key}, near-duplicate of {duplicate_of}")
+
+    for i, item in enumerate(kept, 1):
+        item["index"] = i
+    print(f"Kept {len(kept)}/{len(data)} discussions after near-duplicate removal")
+    return kept
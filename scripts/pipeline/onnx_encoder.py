@@ -0,0 +1,87 @@
+import json
+import os
+
+import numpy as np
+
+from shared_utils import EMBED_BATCH_SIZE
+from embedding_cache import model_cache_id
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+
+''' CPU encoder for the int8 ONNX export of the sentence transformer (sentence-transformer/export_onnx.py).
+Reproduces the SentenceTransformer pipeline: tokenizer.json with max_seq_length truncation, transformer,
+the mean pooling described in 1_Pooling/config.json, then the L2 Normalize module. encode() mirrors
+SentenceTransformer.encode so it drops into encode_cached and LocalClassifier.'''
+
+MODEL_DIR = "../../models/sentence_transformer_model"
+ONNX_FILE = "onnx/model_qint8.onnx"
+
+
+class OnnxEncoder:
+    def __init__(self, model_dir=MODEL_DIR, onnx_file=ONNX_FILE):
+        if onnxruntime is None:
+            raise ImportError("The onnx backend needs onnxruntime and tokenizers installed (uv sync --extra onnx)")
+
+        with open(os.path.join(model_dir, "sentence_bert_config.json"), "r") as f:
+            max_seq_length = json.load(f)["max_seq_length"]
+        with open(os.path.join(model_dir, "1_Pooling/config.json"), "r") as f:
+            pooling = json.load(f)
+        with open(os.path.join(model_dir, "modules.json"), "r") as f:
+            modules = json.load(f)
+        if not pooling["pooling_mode_mean_tokens"]:
+            raise ValueError("OnnxEncoder only implements mean pooling")
+
+        self.dim = pooling["word_embedding_dimension"]
+        self.normalize = any(module["type"].endswith("Normalize") for module in modules)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, onnx_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # Quantized vectors differ slightly from fp32 ones, the export is part of the cache identity
+        self.cache_model_id = f"{model_cache_id(model_dir, onnx_file)}-onnx"
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean over real tokens only
+        mask = attention_mask[..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, texts, batch_size=EMBED_BATCH_SIZE):
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        # Like SentenceTransformer.encode, batch by length so padding stays small
+        order = np.argsort([len(text) for text in texts])
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+
+        return embeddings
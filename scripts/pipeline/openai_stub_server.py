@@ -0,0 +1,140 @@
+import argparse
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+''' Local stand-in for the parts of the OpenAI API the summarizer uses: chat completions, file upload and download,
+and batches. Completions are a deterministic excerpt of the prompt, batches finish after --batch-delay seconds.
+Lets summarize_comments and summarize_batch run end to end without network or cost.
+
+Run from scripts/pipeline:  python openai_stub_server.py --port 8089
+Then:                       OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python fullpipeline.py'''
+
+
+def fake_completion(body):
+    user_prompt = body["messages"][-1]["content"]
+    words = user_prompt.split()
+    content = " ".join(words[-120:])
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": len(user_prompt) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(user_prompt) + len(content)) // 4}
+    }
+
+
+class StubOpenAI:
+    def __init__(self, batch_delay=2.0):
+        self.batch_delay = batch_delay
+        self.files = {}
+        self.batches = {}
+
+    def file_object(self, file_id):
+        file = self.files[file_id]
+        return {"id": file_id, "object": "file", "bytes": len(file["content"]), "created_at": file["created_at"],
+                "filename": file["filename"], "purpose": file["purpose"]}
+
+    def batch_object(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_delay:
+            self.run_batch(batch)
+
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def add_file(self, content, filename, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = {"content": content, "filename": filename, "purpose": purpose,
+                               "created_at": int(time.time())}
+        return file_id
+
+    def run_batch(self, batch):
+        lines = []
+        for line in self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(request["body"])},
+                "error": None
+            }))
+
+        batch["output_file_id"] = self.add_file(("\n".join(lines) + "\n").encode("utf-8"), "output.jsonl", "batch_output")
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(lines), "completed": len(lines), "failed": 0}
+
+    async def chat_completions(self, request):
+        return web.json_response(fake_completion(await request.json()))
+
+    async def create_file(self, request):
+        form = await request.post()
+        upload = form["file"]
+        file_id = self.add_file(upload.file.read(), upload.filename, form.get("purpose"))
+        return web.json_response(self.file_object(file_id))
+
+    async def file_content(self, request):
+        file_id = request.match_info["file_id"]
+        if file_id not in self.files:
+            return web.json_response({"error": {"message": f"No file {file_id}"}}, status=404)
+        return web.Response(body=self.files[file_id]["content"], content_type="application/octet-stream")
+
+    async def create_batch(self, request):
+        body = await request.json()
+        if body.get("input_file_id") not in self.files:
+            return web.json_response({"error": {"message": "Unknown input_file_id"}}, status=400)
+
+        num_requests = self.files[body["input_file_id"]]["content"].count(b"\n")
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": num_requests, "completed": 0, "failed": 0}
+        }
+        return web.json_response(self.batch_object(batch_id))
+
+    async def retrieve_batch(self, request):
+        batch_id = request.match_info["batch_id"]
+        if batch_id not in self.batches:
+            return web.json_response({"error": {"message": f"No batch {batch_id}"}}, status=404)
+        return web.json_response(self.batch_object(batch_id))
+
+
+def make_app(batch_delay=2.0):
+    stub = StubOpenAI(batch_delay)
+    app = web.Application(client_max_size=512 * 1024 * 1024)
+    app.add_routes([
+        web.post("/v1/chat/completions", stub.chat_completions),
+        web.post("/v1/files", stub.create_file),
+        web.get("/v1/files/{file_id}/content", stub.file_content),
+        web.post("/v1/batches", stub.create_batch),
+        web.get("/v1/batches/{batch_id}", stub.retrieve_batch),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--batch-delay", type=float, default=2.0)
+    args = parser.parse_args()
+
+    web.run_app(make_app(args.batch_delay), host="127.0.0.1", port=args.port)
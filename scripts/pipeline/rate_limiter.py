@@ -0,0 +1,162 @@
+import asyncio
+import random
+import re
+import time
+
+from shared_utils import REQUEST_DELAY, OPENAI_TPM, OPENAI_RPM, OPENAI_BURST_SECONDS
+
+''' Shared pacing for every GitHub call. The search and core APIs have separate quotas, so each pool gets its own
+token bucket. Buckets start at a conservative rate and then follow the X-RateLimit-* headers GitHub sends back,
+spreading whatever is left of the quota evenly until the window resets. Retry-After (secondary limits) pauses the pool.
+OpenAI chat completions get a weighted variant: one bucket for requests and one for tokens, each request reserving its
+estimated prompt tokens plus max_tokens, kept in line with the x-ratelimit-remaining-* headers.'''
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, max_rate):
+        self.rate = rate            # tokens per second
+        self.burst = burst          # most requests allowed back to back
+        self.max_rate = max_rate    # never go faster than this, even with plenty of quota left
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # A request larger than the burst could never fit, it waits for a full bucket instead
+        amount = min(amount, self.burst)
+
+        # Waiters queue on the lock so requests go out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def charge(self, amount):
+        """Take tokens for work that turned out to cost more than acquire assumed, the bucket may go negative"""
+        self._refill()
+        self.tokens -= amount
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + max(seconds, 0))
+
+    def adapt(self, remaining, reset_epoch):
+        seconds_left = max(reset_epoch - time.time(), 1)
+
+        if remaining <= 0:
+            self.tokens = 0
+            self.pause(seconds_left)
+            return
+
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+        self.rate = min(self.max_rate, remaining / seconds_left)
+
+
+class GitHubRateLimiter:
+    def __init__(self):
+        self.buckets = {
+            # 30 searches per minute
+            'search': TokenBucket(rate=30 / 60, burst=5, max_rate=30 / 60),
+            # 5000 requests per hour, REQUEST_DELAY is that spread evenly
+            'core': TokenBucket(rate=1 / REQUEST_DELAY, burst=15, max_rate=10),
+            # Counted in points, 5000 per hour: each query takes one up front and charge() adds the rest of its cost
+            'graphql': TokenBucket(rate=1 / REQUEST_DELAY, burst=5, max_rate=2),
+        }
+
+    async def acquire(self, pool):
+        await self.buckets[pool].acquire()
+
+    def charge(self, pool, amount):
+        self.buckets[pool].charge(amount)
+
+    def observe(self, pool, response, body=None):
+        """Update the pool from a response's rate limit headers. body is the text of a 403/429 response"""
+        headers = response.headers
+        bucket = self.buckets.get(headers.get('X-RateLimit-Resource'), self.buckets[pool])
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            bucket.adapt(int(remaining), float(reset))
+
+        # Secondary limits still send X-RateLimit-Remaining, so they are told apart by Retry-After or the message
+        retry_after = headers.get('Retry-After')
+        secondary = 'secondary rate limit' in (body or '').lower()
+        if retry_after is not None:
+            print(f"⏳ GitHub asked to back off for {retry_after}s ({pool})")
+            bucket.pause(float(retry_after))
+        elif response.status in (403, 429) and (secondary or remaining is None):
+            # Secondary limit without a Retry-After, GitHub recommends waiting at least a minute
+            print(f"⏳ Secondary rate limit hit ({pool}), pausing 60s")
+            bucket.pause(60)
+
+
+github_limiter = GitHubRateLimiter()
+
+
+def parse_reset(value):
+    """OpenAI reset headers are durations like "1s", "6m0s" or "20ms", returned in seconds"""
+    if not value:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value))
+
+
+class OpenAIRateLimiter:
+    def __init__(self, tokens_per_minute=OPENAI_TPM, requests_per_minute=OPENAI_RPM, burst_seconds=OPENAI_BURST_SECONDS):
+        # Limits are enforced over short windows, so only a few seconds of the per-minute budget may go out at once
+        token_rate = tokens_per_minute / 60
+        request_rate = requests_per_minute / 60
+        self.buckets = {
+            'tokens': TokenBucket(rate=token_rate, burst=token_rate * burst_seconds, max_rate=token_rate),
+            'requests': TokenBucket(rate=request_rate, burst=max(request_rate * burst_seconds, 1), max_rate=request_rate),
+        }
+
+    async def acquire(self, tokens):
+        await self.buckets['requests'].acquire()
+        await self.buckets['tokens'].acquire(tokens)
+
+    def observe(self, headers):
+        """Follow x-ratelimit-remaining-{tokens,requests}, pausing a bucket the API reports as empty"""
+        for name, bucket in self.buckets.items():
+            remaining = headers.get(f'x-ratelimit-remaining-{name}')
+            if remaining is None:
+                continue
+
+            bucket._refill()
+            bucket.tokens = min(bucket.tokens, float(remaining))
+            if float(remaining) <= 0:
+                bucket.pause(parse_reset(headers.get(f'x-ratelimit-reset-{name}')) or 1)
+
+    def backoff(self, attempt, headers=None, reason="rate limit hit"):
+        """After a 429 (or a 5xx, timeout or dropped connection), hold every request back for the server's hint
+        or a jittered exponential delay"""
+        headers = headers or {}
+        retry_after = headers.get('retry-after')
+        if retry_after is not None:
+            delay = float(retry_after)
+        else:
+            delay = parse_reset(headers.get('x-ratelimit-reset-tokens')) or min(2 ** attempt, 60)
+        delay *= random.uniform(1, 1.5)
+
+        print(f"⏳ OpenAI {reason}, backing off {delay:.1f}s (attempt {attempt + 1})")
+        for bucket in self.buckets.values():
+            bucket.pause(delay)
+
+
+openai_limiter = OpenAIRateLimiter()
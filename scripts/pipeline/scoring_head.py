@@ -0,0 +1,53 @@
+import numpy as np
+
+''' Portable replacement for best_classifier.pkl: a small stack of dense layers stored as plain NumPy arrays in an
+.npz file (W0, b0, W1, b1, ...). A logistic regression head is a single matrix multiply followed by a sigmoid, a
+head distilled from the forest adds one ReLU hidden layer. Exposes predict_proba/predict/classes_ like sklearn, so
+ST_filter_data can use it in place of the pickled classifier. Written by sentence-transformer/train_classifier.py.'''
+
+
+class ScoringHead:
+    def __init__(self, layers, output="sigmoid", classes=(0, 1)):
+        self.layers = [(np.asarray(W, dtype=np.float32), np.asarray(b, dtype=np.float32)) for W, b in layers]
+        self.output = output  # "sigmoid" for logits, "clip" for a regressor that predicts the probability directly
+        self.classes_ = np.asarray(classes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            num_layers = int(f["num_layers"])
+            layers = [(f[f"W{i}"], f[f"b{i}"]) for i in range(num_layers)]
+            return cls(layers, output=str(f["output"]), classes=f["classes"])
+
+    def save(self, path):
+        arrays = {"num_layers": len(self.layers), "output": self.output, "classes": self.classes_}
+        for i, (W, b) in enumerate(self.layers):
+            arrays[f"W{i}"] = W
+            arrays[f"b{i}"] = b
+        np.savez(path, **arrays)
+
+    def predict_proba(self, X):
+        h = np.asarray(X, dtype=np.float32)
+        for i, (W, b) in enumerate(self.layers):
+            h = h @ W + b
+            if i < len(self.layers) - 1:
+                h = np.maximum(h, 0)
+
+        h = h.reshape(-1)
+        if self.output == "sigmoid":
+            positive = 1 / (1 + np.exp(-h))
+        else:
+            positive = np.clip(h, 0, 1)
+
+        return np.stack([1 - positive, positive], axis=1)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    @classmethod
+    def from_logistic_regression(cls, clf):
+        return cls([(clf.coef_.T, clf.intercept_)], output="sigmoid", classes=clf.classes_)
+
+    @classmethod
+    def from_mlp_regressor(cls, mlp, classes=(0, 1)):
+        return cls(list(zip(mlp.coefs_, mlp.intercepts_)), output="clip", classes=classes)
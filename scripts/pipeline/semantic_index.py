@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+
+from shared_utils import SEMANTIC_INDEX_DIR, SEMANTIC_DUP_THRESHOLD
+
+''' Exact nearest neighbour index over L2-normalized discussion embeddings, used to prune reviews that say the same
+thing ("add tests", "rebase please") before summarization. Vectors live in an append-only float32 file read through a
+memory map and are searched in fixed-size blocks, so memory stays flat as the corpus grows to millions of rows.'''
+
+
+class SemanticIndex:
+    def __init__(self, name, dim, threshold=SEMANTIC_DUP_THRESHOLD, index_dir=SEMANTIC_INDEX_DIR, block_size=65536):
+        self.dim = dim
+        self.threshold = threshold
+        self.block_size = block_size
+        self.dir = os.path.join(index_dir, name)
+        self.vectors_file = os.path.join(self.dir, "vectors.f32")
+        self.keys_file = os.path.join(self.dir, "keys.txt")
+        os.makedirs(self.dir, exist_ok=True)
+
+        if os.path.exists(self.keys_file):
+            with open(self.keys_file, "r", encoding="utf-8") as f:
+                self.keys = f.read().split("\n")[:-1]
+        else:
+            self.keys = []
+        self.key_set = set(self.keys)
+
+        # Keys are written after vectors, trim vectors left over by an interrupted add
+        row_bytes = dim * 4
+        if os.path.exists(self.vectors_file) and os.path.getsize(self.vectors_file) > len(self.keys) * row_bytes:
+            with open(self.vectors_file, "r+b") as f:
+                f.truncate(len(self.keys) * row_bytes)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _matrix(self):
+        return np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(len(self.keys), self.dim))
+
+    def search(self, queries):
+        """Best cosine similarity and row for each query, scanning the index block by block"""
+        best_similarity = np.full(len(queries), -np.inf, dtype=np.float32)
+        best_row = np.full(len(queries), -1, dtype=np.int64)
+        if not self.keys or not len(queries):
+            return best_similarity, best_row
+
+        matrix = self._matrix()
+        for start in range(0, len(self.keys), self.block_size):
+            similarities = np.asarray(matrix[start:start + self.block_size]) @ queries.T
+            rows = similarities.argmax(axis=0)
+            block_best = similarities[rows, np.arange(len(queries))]
+
+            better = block_best > best_similarity
+            best_similarity[better] = block_best[better]
+            best_row[better] = rows[better] + start
+
+        return best_similarity, best_row
+
+    def add(self, keys, vectors):
+        if not keys:
+            return
+
+        with open(self.vectors_file, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.keys_file, "a", encoding="utf-8") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+
+        self.keys.extend(keys)
+        self.key_set.update(keys)
+
+    def check_and_add(self, keys, vectors):
+        """For each vector the key it duplicates (>= threshold cosine), or None; non-duplicates are added"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        best_similarity, best_row = self.search(vectors)
+
+        accepted_keys, accepted_vectors, results = [], [], []
+        for key, vector, similarity, row in zip(keys, vectors, best_similarity, best_row):
+            # Already accepted by an earlier run of this iteration
+            if key in self.key_set:
+                results.append(None)
+                continue
+
+            duplicate_of = self.keys[row] if similarity >= self.threshold else None
+
+            # Duplicates inside the same batch are not in the file yet
+            if duplicate_of is None and accepted_vectors:
+                batch_similarities = np.stack(accepted_vectors) @ vector
+                j = int(batch_similarities.argmax())
+                if batch_similarities[j] >= self.threshold:
+                    duplicate_of = accepted_keys[j]
+
+            if duplicate_of is None:
+                accepted_keys.append(key)
+                accepted_vectors.append(vector)
+            results.append(duplicate_of)
+
+        self.add(accepted_keys, accepted_vectors)
+        return results
+
+
+def pooled_embeddings(classifier, items):
+    """Mean of the comment embeddings of each discussion, L2-normalized"""
+    texts = [comment for item in items for comment in item["filtered_comments"]]
+    embeddings = classifier.embed(texts)
+
+    pooled = []
+    offset = 0
+    for item in items:
+        count = len(item["filtered_comments"])
+        vector = embeddings[offset:offset + count].mean(axis=0)
+        pooled.append(vector / max(np.linalg.norm(vector), 1e-12))
+        offset += count
+
+    return np.array(pooled, dtype=np.float32)
+
+
+def open_index(classifier, index_name="discussions"):
+    """Index sized for the classifier's embeddings, for callers that keep one open across batches"""
+    return SemanticIndex(index_name, classifier.embed([""]).shape[1])
+
+
+def drop_semantic_duplicates(items, classifier, index_name="discussions", index=None):
+    if not items:
+        return items
+
+    vectors = pooled_embeddings(classifier, items)
+    if index is None:
+        index = SemanticIndex(index_name, vectors.shape[1])
+    keys = [f"{item.get('repository')}#{item.get('pr_number')}" for item in items]
+
+    kept = []
+    for item, key, duplicate_of in zip(items, keys, index.check_and_add(keys, vectors)):
+        if duplicate_of is None:
+            kept.append(item)
+        else:
+            print(f"!!! REMOVED {key}, semantic duplicate of {duplicate_of}")
+
+    for i, item in enumerate(kept, 1):
+        item["index"] = i
+    print(f"Kept {len(kept)}/{len(items)} discussions after semantic de-duplication ({len(index)} in index)")
+    return kept
@@ -16,6 +16,113 @@ REQUEST_DELAY = 0.72
 MAX_REPOS = 100
 MAX_PRS_PER_REPO = 10
 
+# "rest" makes one comments call and one diff call per PR, "graphql" fetches
+# comments, review threads and PR metadata for a batch of PRs in one query
+FETCH_MODE = "rest"
+GRAPHQL_BATCH_SIZE = 25
+
+# Repos processed at the same time during PR extraction
+REPO_CONCURRENCY = 4
+
+# Conditional request cache for GitHub GETs, entries younger than the TTL (seconds) are served without a request
+HTTP_CACHE_DIR = "../../data/cache/http"
+HTTP_CACHE_TTL = 6 * 3600
+
+# Walk each repo's PRs in update order, searching only after the newest one already looked at. This replaces
+# the most-commented-first selection, so it is off by default
+INCREMENTAL_EXTRACTION = False
+WATERMARK_FILE = "../../data/pipeline/watermarks.json"
+
+# PR diffs are stored compressed under their hash, records keep the digest and length
+BLOB_DIR = "../../data/blobs/diffs"
+
+# transform_critique_data keeps diffs strictly between these lengths (characters)
+MIN_DIFF_LENGTH = 5000
+MAX_DIFF_LENGTH = 80000
+
+# Skip a diff download when its size predicted from PR metadata is this many times outside the window
+DIFF_ESTIMATE_MARGIN = 2.0
+DIFF_HISTORY_FILE = "../../data/pipeline/diff_size_history.jsonl"
+
+# Sentences per forward pass of the sentence transformer
+EMBED_BATCH_SIZE = 64
+
+# Embeddings are cached on disk per model, keyed by comment text hash. Models loaded from a local directory are
+# identified by a hash of their files, this id only names models that cannot be traced back to one
+EMBEDDING_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = "../../data/cache/embeddings"
+
+# "torch" runs the SentenceTransformer, "onnx" the int8 export from sentence-transformer/export_onnx.py
+EMBEDDING_BACKEND = "torch"
+
+# "pickle" scores with best_classifier.pkl, "npz" with the NumPy head train_classifier.py writes to scoring_head.npz
+CLASSIFIER_BACKEND = "pickle"
+
+# Cheap hashed n-gram model decides comments it is confident about (probability <= LOW or >= HIGH),
+# the rest go to the sentence transformer. Trained by sentence-transformer/train_cheap_classifier.py
+CASCADE_ENABLED = True
+CASCADE_LOW = 0.1
+CASCADE_HIGH = 0.9
+CHEAP_CLASSIFIER_PATH = "../../models/cheap_classifier.pkl"
+
+# MinHash near-duplicate removal for comments (before embedding) and discussions (before summarizing),
+# the LSH indexes persist across iterations
+NEAR_DUP_ENABLED = True
+NEAR_DUP_THRESHOLD = 0.8
+NEAR_DUP_DIR = "../../data/cache/near_dup"
+
+# Drop discussions whose pooled comment embedding is within this cosine similarity of one already kept,
+# in this or any earlier iteration (semantic_index.py)
+SEMANTIC_DEDUP_ENABLED = True
+SEMANTIC_DUP_THRESHOLD = 0.95
+SEMANTIC_INDEX_DIR = "../../data/cache/semantic_index"
+
+# Unix socket of the long-lived comment classifier (inference_server.py)
+INFERENCE_SOCKET = "/tmp/gh-pr-discussions-inference.sock"
+INFERENCE_BATCH_WINDOW = 0.02
+INFERENCE_MAX_BATCH = 512
+
+# OpenAI budget for the summarization model, requests go out as fast as these allow. Each request reserves its
+# prompt tokens plus max_tokens, at most OPENAI_BURST_SECONDS worth of budget is spent back to back
+OPENAI_TPM = 200000
+OPENAI_RPM = 500
+OPENAI_BURST_SECONDS = 10
+OPENAI_MAX_RETRIES = 6
+OPENAI_MAX_IN_FLIGHT = 64
+
+# OpenAI summaries are cached in SQLite keyed by model, prompts and max_tokens (summary_cache.py)
+SUMMARY_CACHE_ENABLED = True
+SUMMARY_CACHE_PATH = "../../data/cache/summaries.sqlite"
+
+# Tokens are counted with this model's tokenizer (token_counter.py). Discussions over SUMMARY_MAX_PROMPT_TOKENS
+# are summarized in chunks of SUMMARY_CHUNK_TOKENS whose summaries are then merged. tiktoken downloads the encoding
+# on first use; for offline runs point TIKTOKEN_CACHE_DIR at a directory filled once with network, e.g.
+# TIKTOKEN_CACHE_DIR=../../data/cache/tiktoken python -c "import tiktoken; tiktoken.get_encoding('o200k_base')",
+# otherwise tokens are counted approximately
+TOKENIZER_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_PROMPT_TOKENS = 12000
+SUMMARY_CHUNK_TOKENS = 8000
+
+# "openai" summarizes with the chat model, "extractive" picks central sentences locally (extractive_summarizer.py)
+SUMMARIZER_BACKEND = "openai"
+EXTRACTIVE_MIN_WORDS = 100
+EXTRACTIVE_MAX_WORDS = 120
+EXTRACTIVE_WORKERS = 4
+
+# With the openai backend, "sync" sends one chat completion per discussion, "batch" submits them all through the OpenAI Batch API
+# (summarize_batch.py) and polls every BATCH_POLL_INTERVAL seconds until it finishes
+SUMMARY_MODE = "sync"
+BATCH_DIR = "../../data/pipeline/summary_batches"
+BATCH_POLL_INTERVAL = 30
+
+# "staged" runs each step of an iteration on the whole batch, "streaming" connects them with bounded queues
+# (streaming.py) so every PR is filtered, summarized and transformed as soon as it is extracted. Streaming always
+# summarizes through the synchronous API (SUMMARY_MODE="batch" is ignored with a warning) and, like the staged mode,
+# only writes the extracted discussions and the final critique file, filtered data and summaries stay in memory
+PIPELINE_MODE = "staged"
+STREAM_QUEUE_SIZE = 64
+STREAM_SUMMARY_WORKERS = 16
+
 TEST_MODE = False
 ERROR_RATE = 0.3
 
@@ -41,6 +148,61 @@ def saveJSON(data, filename):
         json.dump(data, f, indent=2, ensure_ascii=False)
     return filename
 
+# Append-only JSONL sink, every record is flushed and fsynced so a crash loses at most the record being written
+class JSONLWriter:
+    def __init__(self, filename, mode='a'):
+        self.filename = filename
+        if mode == 'a':
+            truncateTornLine(filename)
+        self.f = open(filename, mode, encoding='utf-8')
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# A record is only committed once its newline is written, an unterminated last line is what a crash mid-write leaves
+def truncateTornLine(filename):
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+            print(f"Dropped a partially written record at the end of {filename}")
+
+def readJSONL(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            # Skip a torn last line, corruption anywhere else still raises
+            if not line.endswith('\n'):
+                return
+            yield json.loads(line)
+
+# Lazy view over a JSONL file that can be iterated more than once and supports len()
+class JSONLDataset:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __iter__(self):
+        if not os.path.exists(self.filename):
+            return iter(())
+        return readJSONL(self.filename)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 # Display the info gathered, used for visual of progress or debugging
 def summaryDisplay(data, data_type="data"):
     print(f"\n=== {data_type.upper()} SUMMARY ===")
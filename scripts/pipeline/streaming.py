@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_utils import STREAM_QUEUE_SIZE, STREAM_SUMMARY_WORKERS, NEAR_DUP_ENABLED, SEMANTIC_DEDUP_ENABLED, \
+    SUMMARY_MODE, log_error
+from extract_prs import prDiscussionExtraction
+from ST_filter_data import get_classifier, classify_batched, select_items, drop_duplicate_items, CascadeClassifier
+from near_dedup import NearDuplicateIndex, drop_duplicate_comments
+from semantic_index import open_index
+from summarize_comments import get_summarizer, summarize_item
+from transform_critique_data import transform_item
+from blob_store import diff_fields
+
+''' Streaming execution of one iteration: extraction, filtering and summarization plus transformation run as
+concurrent stages connected by bounded asyncio queues, so each PR moves on as soon as it is extracted. A full queue
+makes the stage feeding it wait (extraction holds its PR slot until the filter takes the discussion), which keeps
+memory bounded and the iteration as slow as its slowest stage rather than the sum of all of them.
+
+    extraction --discussions--> filter (one model thread) --selected--> STREAM_SUMMARY_WORKERS x (summarize, transform)
+
+Filtering applies the same near-duplicate and semantic de-duplication as the staged pipeline, batch by batch.
+Summaries always go through the synchronous API, a batch that finishes hours later cannot feed a stream. Finished
+records carry their full diff, so they are spooled to disk as they complete and only their offsets stay in memory
+until the iteration is written out in extraction order.'''
+
+# Marks the end of a queue, one per consumer
+END = None
+
+
+async def stream_iteration(repo_batch, iteration, output_file, checkpoint_callback=None, start_repo=0,
+                           queue_size=STREAM_QUEUE_SIZE, summary_workers=STREAM_SUMMARY_WORKERS):
+    """Writes the critique records of the iteration to output_file in extraction order, returns their number"""
+    if SUMMARY_MODE == "batch":
+        print('!!! SUMMARY_MODE="batch" does not apply to the streaming pipeline, summarizing synchronously')
+
+    loop = asyncio.get_running_loop()
+    discussions = asyncio.Queue(maxsize=queue_size)
+    selected = asyncio.Queue(maxsize=queue_size)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="st-filter")
+    summarizer = get_summarizer()
+    # (sequence, offset in the spool) of every finished record
+    results = []
+    spool_file = f"{output_file}.spool.jsonl"
+    spool = open(spool_file, "w+", encoding="utf-8")
+    start_time = time.perf_counter()
+
+    async def extract():
+        await prDiscussionExtraction(
+            repo_batch,
+            iteration,
+            checkpoint_callback=checkpoint_callback,
+            start_repo=start_repo,
+            discussion_callback=discussions.put
+        )
+        await discussions.put(END)
+
+    def filter_batch(classifier, batch, comment_index, discussion_index, semantic_index):
+        if comment_index is not None:
+            drop_duplicate_comments(batch, comment_index)
+        kept = select_items(batch, classify_batched(classifier, batch))
+        return drop_duplicate_items(kept, classifier, discussion_index, semantic_index)
+
+    async def filter_stage():
+        classifier = await loop.run_in_executor(executor, get_classifier)
+        try:
+            await filter_items(classifier)
+        finally:
+            classifier.close()
+
+        for _ in range(summary_workers):
+            await selected.put(END)
+
+    async def filter_items(classifier):
+        comment_index = NearDuplicateIndex("comments") if NEAR_DUP_ENABLED else None
+        discussion_index = NearDuplicateIndex("discussions") if NEAR_DUP_ENABLED else None
+        # Opened once, every batch would otherwise read the whole key file again
+        semantic_index = await loop.run_in_executor(executor, open_index, classifier) if SEMANTIC_DEDUP_ENABLED \
+            else None
+        sequence = 0
+
+        done = False
+        while not done:
+            # Whatever queued up during the last batch is classified together
+            batch = [await discussions.get()]
+            while not discussions.empty():
+                batch.append(discussions.get_nowait())
+
+            if END in batch:
+                done = True
+                batch = [item for item in batch if item is not END]
+            if not batch:
+                continue
+
+            kept = await loop.run_in_executor(executor, filter_batch, classifier, batch, comment_index,
+                                              discussion_index, semantic_index)
+
+            for item in kept:
+                sequence += 1
+                item["sequence"] = sequence
+                await selected.put(item)
+
+        if isinstance(classifier, CascadeClassifier):
+            classifier.report()
+        if comment_index is not None:
+            comment_index.save()
+            discussion_index.save()
+
+    async def summarize_stage():
+        while (item := await selected.get()) is not END:
+            try:
+                processed_item = await summarize_and_transform(item)
+            # One bad discussion is skipped like one that failed to summarize, the stream keeps going
+            except Exception as e:
+                log_error("pipeline_failure", "stream_summarize", {
+                    "iteration": iteration,
+                    "repository": item.get("repository"),
+                    "pr_number": item.get("pr_number"),
+                    "error": str(e)
+                }, iteration)
+                continue
+            if processed_item is not None:
+                # All workers share the event loop, the seek and write of one record are never interleaved
+                spool.seek(0, os.SEEK_END)
+                results.append((item["sequence"], spool.tell()))
+                spool.write(json.dumps(processed_item, ensure_ascii=False) + "\n")
+
+    async def summarize_and_transform(item):
+        record = await summarize_item(summarizer, item, item["sequence"])
+        transformed_item = {
+            "comments": record["summarized_comments"],
+            "diff_record": diff_fields(item),
+        }
+        # Loading the diff decompresses a blob, off the event loop
+        return await loop.run_in_executor(None, transform_item, transformed_item)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(extract())
+            group.create_task(filter_stage())
+            for _ in range(summary_workers):
+                group.create_task(summarize_stage())
+    except ExceptionGroup as errors:
+        # The first failure is what callers log, the group keeps the rest in the traceback
+        raise errors.exceptions[0] from errors
+    else:
+        results.sort(key=lambda pair: pair[0])
+        write_spooled(spool, [offset for _, offset in results], output_file)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        summarizer.close()
+        spool.close()
+        os.remove(spool_file)
+
+    print(f"Streamed {len(results)} critique records in {time.perf_counter() - start_time:.0f}s")
+    return len(results)
+
+
+def write_spooled(spool, offsets, output_file):
+    """Same JSON array json.dump(records, f, indent=2) writes, built one record at a time"""
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write("[" if offsets else "[]")
+        for index, offset in enumerate(offsets, 1):
+            spool.seek(offset)
+            processed_item = json.loads(spool.readline())
+            processed_item["index"] = index
+            f.write(("," if index > 1 else "") + "\n" + textwrap.indent(json.dumps(processed_item, indent=2), "  "))
+        f.write("\n]" if offsets else "")
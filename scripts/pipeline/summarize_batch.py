@@ -0,0 +1,201 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import time
+
+from shared_utils import log_error, SUMMARY_CACHE_ENABLED, BATCH_DIR, BATCH_POLL_INTERVAL, SUMMARY_MAX_PROMPT_TOKENS, \
+    OPENAI_MAX_IN_FLIGHT, OPENAI_MAX_RETRIES
+from summary_cache import SummaryCache, summary_key
+from summarize_comments import get_async_client, summarize_discussion, SUMMARY_MODEL, SUMMARY_MAX_TOKENS, \
+    SYSTEM_PROMPT, USER_PROMPT
+from token_counter import count_tokens
+
+''' Offline summarization through the OpenAI Batch API: every request that is not in the summary cache goes into one
+JSONL file, which is uploaded and run as a batch at half the synchronous price. The batch id is kept next to the file,
+so an interrupted run resumes polling the same batch instead of submitting it again, unless that batch failed, expired
+or was cancelled. Outputs are matched back to the discussions by custom_id and returned in the same records as
+process_comments_concurrently.
+
+For a run without network, start openai_stub_server.py and set OPENAI_BASE_URL=http://127.0.0.1:8089/v1'''
+
+
+# File and batch calls are not paced by openai_limiter, they keep the SDK's own retries
+@functools.lru_cache(maxsize=1)
+def get_batch_client():
+    return get_async_client().with_options(max_retries=OPENAI_MAX_RETRIES)
+
+
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+# A saved batch in one of these has nothing to resume
+DEAD_STATUSES = ("failed", "expired", "cancelled")
+
+
+def build_request(custom_id, comments):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": SUMMARY_MODEL,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": USER_PROMPT.format(comments=comments)}
+            ],
+            "max_tokens": SUMMARY_MAX_TOKENS
+        }
+    }
+
+
+def write_batch_file(requests):
+    """Batch input named after its content, so the same work maps to the same file and batch"""
+    lines = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests)
+    digest = hashlib.sha256(lines.encode("utf-8")).hexdigest()[:16]
+
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    batch_file = os.path.join(BATCH_DIR, f"{digest}.jsonl")
+    with open(batch_file, "w", encoding="utf-8") as f:
+        f.write(lines)
+    return batch_file
+
+
+async def submit_batch(batch_file):
+    state_file = f"{batch_file}.batch.json"
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as f:
+            batch_id = json.load(f)["batch_id"]
+
+        batch = await get_batch_client().batches.retrieve(batch_id)
+        if batch.status not in DEAD_STATUSES:
+            print(f"Resuming batch {batch_id}")
+            return batch_id
+        print(f"Saved batch {batch_id} is {batch.status}, submitting again")
+
+    with open(batch_file, "rb") as f:
+        uploaded = await get_batch_client().files.create(file=f, purpose="batch")
+    batch = await get_batch_client().batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump({"batch_id": batch.id, "input_file_id": uploaded.id}, f)
+    print(f"Submitted batch {batch.id} ({batch_file})")
+    return batch.id
+
+
+async def wait_for_batch(batch_id, poll_interval=BATCH_POLL_INTERVAL):
+    start_time = time.perf_counter()
+    while True:
+        batch = await get_batch_client().batches.retrieve(batch_id)
+        if batch.status in FINISHED_STATUSES:
+            print(f"Batch {batch_id} {batch.status} after {time.perf_counter() - start_time:.0f}s")
+            return batch
+
+        counts = batch.request_counts
+        if counts:
+            print(f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+        await asyncio.sleep(poll_interval)
+
+
+async def download_results(batch):
+    """custom_id -> summary for every request that succeeded"""
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+
+        content = await get_batch_client().files.content(file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            response = output.get("response") or {}
+            if response.get("status_code") == 200:
+                results[output["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            else:
+                print(f"Batch request {output['custom_id']} failed: {output.get('error') or response.get('body')}")
+
+    return results
+
+
+async def process_comments_batch(data, use_cache=SUMMARY_CACHE_ENABLED, poll_interval=BATCH_POLL_INTERVAL,
+                                 max_in_flight=OPENAI_MAX_IN_FLIGHT):
+    """Batch API counterpart of process_comments_concurrently, same output records in the same order"""
+    cache = SummaryCache() if use_cache else None
+    try:
+        items = []
+        requests = []
+        for index, item in enumerate(data, 1):
+            comments = '\n'.join(item.get("filtered_comments", ""))
+            request = build_request(f"item-{index}", comments)
+            body = request["body"]
+            key = summary_key(SUMMARY_MODEL, SYSTEM_PROMPT, body["messages"][1]["content"], SUMMARY_MAX_TOKENS)
+
+            # Discussions over the prompt budget need map-reduce, they go through the synchronous path below
+            num_tokens = count_tokens(comments)
+            summary = cache.get(key) if cache is not None and num_tokens <= SUMMARY_MAX_PROMPT_TOKENS else None
+            if summary is None and num_tokens <= SUMMARY_MAX_PROMPT_TOKENS:
+                requests.append(request)
+            items.append((index, comments, num_tokens, key, summary))
+
+        results = {}
+        if requests:
+            batch = await wait_for_batch(await submit_batch(write_batch_file(requests)), poll_interval)
+            results = await download_results(batch)
+
+        # Oversized discussions and requests the batch did not complete go through the synchronous API,
+        # concurrently and paced by openai_limiter like process_comments_concurrently. Failures keep an empty summary
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def summarize_synchronously(index, comments):
+            async with semaphore:
+                print(f"processing comment #{index} synchronously")
+                try:
+                    return await summarize_discussion(comments, cache)
+                except Exception as e:
+                    log_error("api_failure", "summarize_batch", {"error": str(e), "index": index})
+                    return None
+
+        summaries = {}
+        missing = []
+        for index, comments, num_tokens, key, summary in items:
+            if summary is None:
+                summary = results.get(f"item-{index}")
+                if summary and cache is not None:
+                    cache.put(key, summary, SUMMARY_MODEL)
+            if summary is None:
+                missing.append((index, comments))
+            summaries[index] = summary
+
+        fallback = await asyncio.gather(*(summarize_synchronously(index, comments) for index, comments in missing))
+        for (index, _), summary in zip(missing, fallback):
+            summaries[index] = summary
+
+        records = []
+        for index, comments, num_tokens, key, _ in items:
+            summary = summaries[index] or ""
+            records.append({
+                "index": index,
+                "unsumarized_length": len(comments),
+                "unsumarized_tokens": num_tokens,
+                "unsumarized_comments": comments,
+                "sumarized_length": len(summary),
+                "sumarized_tokens": count_tokens(summary),
+                "summarized_comments": summary,
+            })
+
+        print(f"Summarized {len(records)} discussions, {len(requests)} through the Batch API")
+        return records
+    except Exception as e:
+        log_error("api_failure", "summarize_batch", {
+            "error": str(e),
+            "comment_length": len(data)
+        })
+        raise
+    finally:
+        if cache is not None:
+            cache.report()
+            cache.close()
@@ -1,17 +1,43 @@
 
+import abc
+import functools
 import json
 import openai
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from openai import AsyncOpenAI
 import os
 from dotenv import load_dotenv
-from shared_utils import log_error, TEST_MODE
+from shared_utils import log_error, TEST_MODE, SUMMARY_CACHE_ENABLED, OPENAI_MAX_RETRIES, OPENAI_MAX_IN_FLIGHT, \
+    SUMMARIZER_BACKEND, EXTRACTIVE_WORKERS, SUMMARY_MAX_PROMPT_TOKENS, SUMMARY_CHUNK_TOKENS
+import extractive_summarizer
+from summary_cache import SummaryCache, summary_key
+from rate_limiter import openai_limiter
+from token_counter import count_tokens, split_by_tokens
 import random
 
 load_dotenv()
 
-client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Retries of rate limited calls belong to openai_limiter, SDK retries would bypass its pacing and backoff.
+# Everything the SDK would have retried goes through the same loop (APITimeoutError is an APIConnectionError)
+RETRIED_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+# Built on first use, so runs with the extractive backend import this module without an OPENAI_API_KEY
+@functools.lru_cache(maxsize=1)
+def get_async_client():
+    return AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 325
+
+SYSTEM_PROMPT = "You are an expert code reviewer writing concise technical summaries. Extract and preserve only actionable technical content - specific bugs, implementation suggestions, security concerns, and concrete decisions. Eliminate repetitive explanations and filler language. Focus on what developers need to know and do, not why or background context. Maintain technical accuracy while being ruthlessly concise."
+
+# Reduce step for discussions too long for one prompt, the partial summaries of its chunks are merged with this
+REDUCE_PROMPT = "Merge these partial summaries of one PR discussion into a single summary focusing on concrete technical issues and actionable recommendations (100-120 words). Keep every distinct problem, suggestion and decision, drop repeated points. Preserve technical terminology. Write as direct developer feedback, not documentation {comments}."
+
+USER_PROMPT = "Summarize this PR comment focusing on concrete technical issues and actionable recommendations (100-120 words). Prioritize: Specific problems identified (bugs, errors, incompatibilities) Implementation suggestions (API changes, code modifications, architectural decisions) Security or performance concerns Clear next steps or decisions made Preserve technical terminology but eliminate redundancy. Write as direct developer feedback, not documentation {comments}."
 
 async def getComments(input_file, output_file):
     try:
@@ -34,7 +60,7 @@ async def getComments(input_file, output_file):
     except Exception as e:
         print(f"Error: {str(e)}")
 
-async def summarize_comments(comments):
+async def summarize_comments(comments, cache=None, prompt=USER_PROMPT):
     """Send multiple comments in one API call"""
 
     # User Prompt v1: Summarize this PR comment as a brief, natural critique (60-80 words). Write as if you're an experienced developer giving direct feedback. Focus on the core technical points and any decisions made. Avoid verbose explanations and get straight to the point:\n {comments}   
@@ -46,48 +72,165 @@ async def summarize_comments(comments):
     # User Prompt v2: Summarize this PR comment focusing on concrete technical issues and actionable recommendations (100-120 words). Prioritize: Specific problems identified (bugs, errors, incompatibilities) Implementation suggestions (API changes, code modifications, architectural decisions) Security or performance concerns Clear next steps or decisions made Preserve technical terminology but eliminate redundancy. Write as direct developer feedback, not documentation {comments}.
     # System Prompt v2: You are an expert code reviewer writing concise technical summaries. Extract and preserve only actionable technical content - specific bugs, implementation suggestions, security concerns, and concrete decisions. Eliminate repetitive explanations and filler language. Focus on what developers need to know and do, not why or background context. Maintain technical accuracy while being ruthlessly concise.
 
-    full_prompt = f"Summarize this PR comment focusing on concrete technical issues and actionable recommendations (100-120 words). Prioritize: Specific problems identified (bugs, errors, incompatibilities) Implementation suggestions (API changes, code modifications, architectural decisions) Security or performance concerns Clear next steps or decisions made Preserve technical terminology but eliminate redundancy. Write as direct developer feedback, not documentation {comments}."
-
-    response = await async_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system", 
-                "content": "You are an expert code reviewer writing concise technical summaries. Extract and preserve only actionable technical content - specific bugs, implementation suggestions, security concerns, and concrete decisions. Eliminate repetitive explanations and filler language. Focus on what developers need to know and do, not why or background context. Maintain technical accuracy while being ruthlessly concise."
-            },
-            {
-                "role": "user", 
-                "content": full_prompt
-            }
-        ],
-        max_tokens=325
-    )
-
-    # print(full_prompt)
+    user_prompt = prompt.format(comments=comments)
+
+    if cache is not None:
+        key = summary_key(SUMMARY_MODEL, SYSTEM_PROMPT, user_prompt, SUMMARY_MAX_TOKENS)
+        summary = cache.get(key)
+        if summary is not None:
+            return summary
+
+    # The API counts max_tokens against the token budget up front, so the reservation does too
+    budget = count_tokens(SYSTEM_PROMPT) + count_tokens(user_prompt) + SUMMARY_MAX_TOKENS
+
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        await openai_limiter.acquire(budget)
+        try:
+            raw_response = await get_async_client().chat.completions.with_raw_response.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {
+                        "role": "system", 
+                        "content": SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user", 
+                        "content": user_prompt
+                    }
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+        except RETRIED_ERRORS as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            response = getattr(e, "response", None)
+            reason = "rate limit hit" if isinstance(e, openai.RateLimitError) else type(e).__name__
+            openai_limiter.backoff(attempt, response.headers if response is not None else None, reason)
+            continue
+
+        openai_limiter.observe(raw_response.headers)
+        response = raw_response.parse()
+        break
+
+    # print(user_prompt)
     #print(f"\n\n\n{response.choices[0].message.content}")
-    return response.choices[0].message.content
+    summary = response.choices[0].message.content
+    if cache is not None and summary:
+        cache.put(key, summary, SUMMARY_MODEL)
+    return summary
+
+async def summarize_discussion(comments, cache=None):
+    """One request when the comments fit SUMMARY_MAX_PROMPT_TOKENS, otherwise map-reduce:
+    token-bounded chunks are summarized concurrently and the partial summaries merged with REDUCE_PROMPT"""
+    if count_tokens(comments) <= SUMMARY_MAX_PROMPT_TOKENS:
+        return await summarize_comments(comments, cache)
+
+    chunks = split_by_tokens(comments, SUMMARY_CHUNK_TOKENS)
+    print(f"Discussion of {count_tokens(comments)} tokens, summarizing {len(chunks)} chunks")
+    partials = await asyncio.gather(*(summarize_comments(chunk, cache) for chunk in chunks))
+    merged = "\n\n".join(partial for partial in partials if partial)
+
+    # Only threads of hundreds of chunks need more than one reduce round
+    if count_tokens(merged) > SUMMARY_MAX_PROMPT_TOKENS:
+        return await summarize_discussion(merged, cache)
+    return await summarize_comments(merged, cache, prompt=REDUCE_PROMPT)
+
+class Summarizer(abc.ABC):
+    """Turns the joined comments of one discussion into a summary"""
+
+    @abc.abstractmethod
+    async def summarize(self, comments):
+        ...
+
+    @abc.abstractmethod
+    def close(self):
+        """Release the cache, process pool or connections the backend holds"""
+
+
+class OpenAISummarizer(Summarizer):
+    def __init__(self, use_cache=SUMMARY_CACHE_ENABLED):
+        self.cache = SummaryCache() if use_cache else None
 
-async def process_comments_concurrently(data, semaphore_limit=5):
+    async def summarize(self, comments):
+        return await summarize_discussion(comments, self.cache)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.report()
+            self.cache.close()
+
+
+class ExtractiveSummarizer(Summarizer):
+    """No API calls: central sentences picked on a pool of processes that each hold the sentence transformer"""
+
+    def __init__(self, workers=EXTRACTIVE_WORKERS):
+        # spawn, since the parent may already run model threads that a fork would copy mid-flight
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=extractive_summarizer.init_worker
+        )
+
+    async def summarize(self, comments):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, extractive_summarizer.summarize, comments)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def get_summarizer(backend=SUMMARIZER_BACKEND, use_cache=SUMMARY_CACHE_ENABLED):
+    if backend == "extractive":
+        return ExtractiveSummarizer()
+    return OpenAISummarizer(use_cache)
+
+async def summarize_item(summarizer, item, index):
+    """Summary record for one filtered discussion, with an empty summary if the API kept failing"""
+    comments = '\n'.join(item.get("filtered_comments", ""))
+    print(f"processing comment #{index}")
+    try:
+        summarized = await summarizer.summarize(comments)
+    # Any backend failure (API errors, a crashed extractive worker) only costs this discussion
+    except Exception as e:
+        log_error("api_failure", "summarize_comments", {
+            "error": str(e),
+            "index": index,
+            "comment_length": len(comments)
+        })
+        summarized = ""
+    summarized = summarized or ""
+    return {
+        "index": index,
+        "unsumarized_length": len(comments),
+        "unsumarized_tokens": count_tokens(comments),
+        "unsumarized_comments": comments,
+        "sumarized_length": len(summarized),
+        "sumarized_tokens": count_tokens(summarized),
+        "summarized_comments": summarized,
+    }
+
+async def process_comments_concurrently(data, max_in_flight=OPENAI_MAX_IN_FLIGHT, use_cache=SUMMARY_CACHE_ENABLED,
+                                        summarizer=None):
+    """Summarize every discussion, with the OpenAI backend as many at once as the token and request budget allows.
+    A discussion that still fails after the retries keeps its record with an empty summary"""
+    owns_summarizer = summarizer is None
+    if owns_summarizer:
+        summarizer = get_summarizer(use_cache=use_cache)
     try:
         if TEST_MODE and random.random() < 0.2:
             raise openai.RateLimitError("Simulated OpenAI rate limit")
-        semaphore = asyncio.Semaphore(semaphore_limit)
+        # openai_limiter does the pacing, this only caps open connections and queued work
+        semaphore = asyncio.Semaphore(max_in_flight)
 
         async def process_item(item, index):
             async with semaphore:
-                comments = '\n'.join(item.get("filtered_comments", ""))
-                print(f"processing comment #{index}")
-                summarized = await summarize_comments(comments)
-                return {
-                    "index": index,
-                    "unsumarized_length": len(comments),
-                    "unsumarized_comments": comments,
-                    "sumarized_length": len(summarized),
-                    "summarized_comments": summarized,
-                }
+                return await summarize_item(summarizer, item, index)
         
         tasks = [process_item(item, i+1) for i, item in enumerate(data)]
-        return await asyncio.gather(*tasks)
+        results = await asyncio.gather(*tasks)
+        failed = sum(1 for record in results if not record["summarized_comments"])
+        if failed:
+            print(f"!!! {failed}/{len(results)} discussions could not be summarized")
+        return results
     except Exception as e:
         log_error("api_failure", "summarize_comments", {
             "error": str(e),
@@ -95,6 +238,9 @@ async def process_comments_concurrently(data, semaphore_limit=5):
             "comment_length": len(data)
         })
         raise
+    finally:
+        if owns_summarizer:
+            summarizer.close()
   
 if __name__ == "__main__":
     asyncio.run(getComments("../../data/pipeline/4_filtered_data.json", "../../data/pipeline/5_summarized_comments2.json"))   
\ No newline at end of file
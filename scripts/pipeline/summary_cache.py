@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from shared_utils import SUMMARY_CACHE_PATH
+
+''' Persistent cache of LLM summaries in SQLite. The key is a hash of everything that determines the completion
+(model, system prompt, user prompt, max_tokens), so reruns, resumes and PRs seen again in a later iteration are
+served from disk, and changing a prompt or the model simply misses instead of returning stale summaries.'''
+
+
+def summary_key(model, system_prompt, user_prompt, max_tokens):
+    payload = json.dumps([model, system_prompt, user_prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SummaryCache:
+    def __init__(self, path=SUMMARY_CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        # WAL lets a second pipeline process read while this one writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, model TEXT, summary TEXT NOT NULL, created_at TEXT)"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        row = self.conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, summary, model=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, model, summary, created_at) VALUES (?, ?, ?, ?)",
+            (key, model, summary, datetime.now().isoformat())
+        )
+        self.conn.commit()
+
+    def report(self):
+        total = max(self.hits + self.misses, 1)
+        print(f"Summary cache: {self.hits} hits, {self.misses} misses ({self.hits / total:.1%} hit rate)")
+
+    def close(self):
+        self.conn.close()
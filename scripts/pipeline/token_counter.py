@@ -0,0 +1,102 @@
+import functools
+
+import tiktoken
+
+from shared_utils import TOKENIZER_MODEL
+
+''' Exact token counts with the summarization model's tokenizer. The encoding is built once per process and reused,
+counting is cheap enough to run on every discussion and diff. Without network and a pre-seeded tiktoken cache the
+counts fall back to an approximation, see TOKENIZER_MODEL in shared_utils.py.'''
+
+
+class ApproximateEncoding:
+    """Stand-in when the BPE file can't be loaded: every APPROX_BYTES_PER_TOKEN bytes count as one token,
+    about what the OpenAI tokenizers average on English text and code"""
+    APPROX_BYTES_PER_TOKEN = 4
+
+    def encode_ordinary(self, text):
+        data = text.encode("utf-8")
+        step = self.APPROX_BYTES_PER_TOKEN
+        return [data[i:i + step] for i in range(0, len(data), step)]
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode_bytes(self, tokens):
+        return b"".join(tokens)
+
+
+@functools.lru_cache(maxsize=4)
+def get_encoding(model=TOKENIZER_MODEL):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Models newer than the installed tiktoken use the gpt-4o encoding
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads the BPE file on first use, offline runs without a seeded TIKTOKEN_CACHE_DIR end up here
+        print(f"Tokenizer for {model} unavailable ({type(e).__name__}), counting tokens approximately")
+        return ApproximateEncoding()
+
+
+def count_tokens(text, model=TOKENIZER_MODEL):
+    if not text:
+        return 0
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def cut_tokens(encoding, tokens, max_tokens):
+    """(text, token count) pieces of at most max_tokens, never cut inside a multi-byte character"""
+    pieces = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        # Byte-level tokens can end mid-character, move the cut back to the last clean boundary,
+        # or forward when not even one token ends cleanly
+        while end > start + 1 and not decodes(encoding, tokens[start:end]):
+            end -= 1
+        while end < len(tokens) and not decodes(encoding, tokens[start:end]):
+            end += 1
+
+        pieces.append((encoding.decode_bytes(tokens[start:end]).decode("utf-8"), end - start))
+        start = end
+    return pieces
+
+
+def decodes(encoding, tokens):
+    try:
+        encoding.decode_bytes(tokens).decode("utf-8")
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def split_by_tokens(text, max_tokens, model=TOKENIZER_MODEL):
+    """Non-empty chunks of at most max_tokens, cut between lines where possible"""
+    encoding = get_encoding(model)
+    lines = text.split("\n")
+    line_tokens = encoding.encode_ordinary_batch(lines)
+
+    chunks = []
+    current, current_tokens = [], 0
+    for line, tokens in zip(lines, line_tokens):
+        # +1 for the newline joining it to the previous line
+        if current and current_tokens + len(tokens) + 1 > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+
+        # A single line over the budget is cut by tokens, its last piece starts the next chunk
+        num_tokens = len(tokens)
+        if num_tokens > max_tokens:
+            pieces = cut_tokens(encoding, tokens, max_tokens)
+            chunks.extend(piece for piece, _ in pieces[:-1])
+            line, num_tokens = pieces[-1]
+
+        current.append(line)
+        current_tokens += num_tokens + 1
+
+    if current:
+        chunks.append("\n".join(current))
+    # Blank lines around a cut would otherwise become chunks of their own
+    return [chunk for chunk in chunks if chunk.strip()]
@@ -1,4 +1,7 @@
 import json
+from blob_store import load_diff
+from token_counter import count_tokens
+from shared_utils import MIN_DIFF_LENGTH, MAX_DIFF_LENGTH
 
 async def get_model_data(summary_data, codediff_data):
 
@@ -10,27 +13,23 @@ async def get_model_data(summary_data, codediff_data):
             "index": index,
             "comments": item.get("summarized_comments", ""),
             "codeDiff": None,
-            "token_estimation": None
+            "diff_record": {},
+            "token_count": None
         }
 
         transformed_data.append(transformed_item)
     
 
     for i, item in enumerate(codediff_data):
-        transformed_data[i]["codeDiff"] = item.get("diff", "")
-
-    transformed_data = [item for item in transformed_data if item["codeDiff"].strip()]
-
-    for i, item in enumerate(transformed_data, 1):
-        item["token_estimation"] = (len(item.get("comments", "")) + len(item.get("codeDiff", ""))) / 4
-        processed_item = preprocess(item)
-        # (len(item.get("codediff", 0)) > 5000 and len(item.get("codediff", 0) < 80000))
-        if ((len(item.get("codeDiff", 0)) > 5000) and (len(item.get("codeDiff", 0)) < 80000)):
-            index += 1
-            processed_item["index"] = index
-            final_data.append(processed_item)
-        else:
-            print(f"Removed codediff of length: {len(item.get("codeDiff", 0))}")
+        transformed_data[i]["diff_record"] = item
+
+    for item in transformed_data:
+        processed_item = transform_item(item)
+        if processed_item is None:
+            continue
+        index += 1
+        processed_item["index"] = index
+        final_data.append(processed_item)
     
     print(f"Successfully transformed {len(final_data)} items")
 
@@ -38,6 +37,33 @@ async def get_model_data(summary_data, codediff_data):
 
 
 
+def transform_item(item):
+    """Critique record for one summary and its diff record, None if it does not qualify"""
+    # Discussions whose summarization failed keep their place with an empty summary
+    if not (item["comments"] or "").strip():
+        return None
+
+    # Check the stored length first so diffs outside the window are never decompressed,
+    # older records without one are measured on their text
+    diff_length = item["diff_record"].get("diff_length")
+    if diff_length is None:
+        diff_length = len(load_diff(item["diff_record"]))
+    if not diff_length:
+        return None
+    if not (MIN_DIFF_LENGTH < diff_length < MAX_DIFF_LENGTH):
+        print(f"Removed codediff of length: {diff_length}")
+        return None
+
+    item["codeDiff"] = load_diff(item["diff_record"])
+    if not item["codeDiff"].strip():
+        return None
+
+    item["token_count"] = count_tokens(item["comments"]) + count_tokens(item["codeDiff"])
+    processed_item = preprocess(item)
+    processed_item["token_count"] = item["token_count"]
+    return processed_item
+
+
 def preprocess(data):
     return {
         "prompt" : [{"role": "user", "content": data["codeDiff"]}],
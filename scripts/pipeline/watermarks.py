@@ -0,0 +1,41 @@
+import json
+import os
+
+from shared_utils import WATERMARK_FILE
+
+''' Per repo "updated since" watermarks. Incremental runs search each repo's PRs oldest update first, starting after
+the watermark, and the watermark then moves to the newest updated_at of the prefix of those results that was fully
+looked at. PRs past that prefix (cut off by the per repo limit) are found again by the next run.'''
+
+
+class WatermarkStore:
+    def __init__(self, path=WATERMARK_FILE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.watermarks = json.load(f)
+        except FileNotFoundError:
+            self.watermarks = {}
+
+    def get(self, repo_fullName):
+        return self.watermarks.get(repo_fullName)
+
+    def advance(self, repo_fullName, prs):
+        """Move the repo's watermark to the newest updated_at among prs, which must be a fully consumed
+        prefix of the oldest-first search, not just the PRs that were kept"""
+        timestamps = [pr['updated_at'] for pr in prs if pr.get('updated_at')]
+        if not timestamps:
+            return
+
+        # GitHub timestamps are ISO 8601 in UTC, so they compare correctly as strings
+        newest = max(timestamps)
+        current = self.watermarks.get(repo_fullName)
+        if current is None or newest > current:
+            self.watermarks[repo_fullName] = newest
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.watermarks, f, indent=2)
+        os.replace(tmp_path, self.path)
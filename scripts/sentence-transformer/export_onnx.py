@@ -0,0 +1,109 @@
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import torch
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from sentence_transformers import SentenceTransformer
+
+sys.path.append("../pipeline")
+from onnx_encoder import OnnxEncoder
+
+# Exports the sentence transformer to ONNX, quantizes it to int8 for CPU inference, then checks that
+# best_classifier.pkl predicts the same labels on its embeddings and compares throughput with PyTorch.
+# Needs the onnx extra: uv sync --extra onnx
+
+MODEL_DIR = "../../models/sentence_transformer_model"
+ONNX_DIR = f"{MODEL_DIR}/onnx"
+FP32_FILE = f"{ONNX_DIR}/model.onnx"
+QINT8_FILE = f"{ONNX_DIR}/model_qint8.onnx"
+LABELED_FILE = "../../data/sentence-transformer/labeled_comments_formatted.json"
+
+# The int8 model is only a drop-in replacement if best_classifier.pkl labels (nearly) every comment the same way
+MIN_AGREEMENT = 0.99
+
+
+def export(model):
+    """Export the bare transformer, pooling and normalization are done by OnnxEncoder"""
+    os.makedirs(ONNX_DIR, exist_ok=True)
+
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    sample = tokenizer(["An example comment to trace the graph"], return_tensors="pt")
+
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            FP32_FILE,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+
+    quantize_dynamic(FP32_FILE, QINT8_FILE, weight_type=QuantType.QInt8)
+
+    print(f"Exported {FP32_FILE} ({os.path.getsize(FP32_FILE) / 1e6:.1f} MB)")
+    print(f"Quantized {QINT8_FILE} ({os.path.getsize(QINT8_FILE) / 1e6:.1f} MB)")
+
+
+def benchmark(encoder, texts, runs=3):
+    encoder.encode(texts[:32])  # warm up
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        encoder.encode(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+
+def parity_check(model, onnx_encoder):
+    with open(LABELED_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    texts = [d["text"] for d in data if d["label"] is not None]
+    labels = np.array([d["label"] for d in data if d["label"] is not None])
+
+    with open("../../models/best_classifier.pkl", "rb") as f:
+        classifier = pickle.load(f)
+
+    torch_embeddings = model.encode(texts)
+    onnx_embeddings = onnx_encoder.encode(texts)
+
+    cosine = (torch_embeddings * onnx_embeddings).sum(axis=1) / (
+        np.linalg.norm(torch_embeddings, axis=1) * np.linalg.norm(onnx_embeddings, axis=1)
+    )
+    torch_pred = classifier.predict(torch_embeddings)
+    onnx_pred = classifier.predict(onnx_embeddings)
+
+    print("\nParity on the labeled set")
+    print("="*60)
+    print(f"Comments:                 {len(texts)}")
+    print(f"Mean cosine (fp32/int8):  {cosine.mean():.4f} (min {cosine.min():.4f})")
+    agreement = (torch_pred == onnx_pred).mean()
+    print(f"Prediction agreement:     {agreement:.3f} (required {MIN_AGREEMENT})")
+    print(f"Accuracy fp32 torch:      {(torch_pred == labels).mean():.3f}")
+    print(f"Accuracy int8 onnx:       {(onnx_pred == labels).mean():.3f}")
+
+    print("\nThroughput (comments/s, best of 3)")
+    print("="*60)
+    print(f"PyTorch fp32: {benchmark(model, texts):.0f}")
+    print(f"ONNX int8:    {benchmark(onnx_encoder, texts):.0f}")
+
+    return agreement >= MIN_AGREEMENT
+
+
+if __name__ == "__main__":
+    model = SentenceTransformer(MODEL_DIR, device="cpu")
+    export(model)
+    if not parity_check(model, OnnxEncoder(MODEL_DIR)):
+        sys.exit(f"\nParity check failed: int8 predictions agree less than {MIN_AGREEMENT:.0%} with PyTorch, "
+                 f"keep EMBEDDING_BACKEND = \"torch\"")
+    print("\nSet EMBEDDING_BACKEND = \"onnx\" in pipeline/shared_utils.py to use the quantized model")
@@ -0,0 +1,48 @@
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+from sklearn.pipeline import make_pipeline
+import json
+import numpy as np
+import pickle
+import sys
+
+# Report on the thresholds the pipeline's cascade actually uses
+sys.path.append("../pipeline")
+from shared_utils import CASCADE_LOW, CASCADE_HIGH
+
+# Trains the cheap first tier of the filtering cascade: hashed character n-grams into a logistic regression,
+# on the same labeled comments as train_classifier.py. ST_filter_data only sends comments this model is unsure
+# about (probability between CASCADE_LOW and CASCADE_HIGH) on to the sentence transformer.
+
+with open("../../data/sentence-transformer/labeled_comments_formatted.json", "r", encoding="utf-8") as f:
+    data = json.load(f)
+
+texts = [d["text"] for d in data if d["label"] is not None]
+labels = np.array([d["label"] for d in data if d["label"] is not None])
+
+cheap_model = make_pipeline(
+    # Hashing needs no fitted vocabulary, so the pickle stays small and unseen words cost nothing
+    HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=2**18, alternate_sign=False, norm="l2"),
+    LogisticRegression(C=4.0, max_iter=2000, random_state=42)
+)
+
+cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+probabilities = cross_val_predict(cheap_model, texts, labels, cv=cv, method="predict_proba")[:, 1]
+predictions = (probabilities >= 0.5).astype(int)
+
+print("Cheap classifier (5-fold out-of-fold)")
+print("="*60)
+print(f"Accuracy on everything: {(predictions == labels).mean():.3f}")
+
+print(f"\n{'low':>5} {'high':>5} {'decided':>8} {'accuracy on decided':>20}")
+for low, high in [(0.05, 0.95), (CASCADE_LOW, CASCADE_HIGH), (0.2, 0.8), (0.3, 0.7)]:
+    decided = (probabilities <= low) | (probabilities >= high)
+    accuracy = (predictions[decided] == labels[decided]).mean() if decided.any() else float("nan")
+    print(f"{low:>5.2f} {high:>5.2f} {decided.mean():>8.1%} {accuracy:>20.3f}")
+
+cheap_model.fit(texts, labels)
+with open("../../models/cheap_classifier.pkl", "wb") as f:
+    pickle.dump(cheap_model, f)
+
+print("\nSaved ../../models/cheap_classifier.pkl")
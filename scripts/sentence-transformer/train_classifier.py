@@ -1,114 +1,246 @@
-from sentence_transformers import SentenceTransformer
+from sklearn.base import clone
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.svm import SVC
 from xgboost import XGBClassifier
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.metrics import classification_report, accuracy_score
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 import numpy as np
 import pandas as pd
 import pickle
 import joblib
-
-# Load labeled data
-with open("../../data/sentence-transformer/labeled_comments_formatted.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-texts = [d["text"] for d in data if d["label"] is not None]
-labels = [d["label"] for d in data if d["label"] is not None]
-
-# Embed comments
-model = SentenceTransformer('all-MiniLM-L6-v2')
-embeddings = model.encode(texts)
-
+import sys
+import time
+
+# Share the pipeline's on-disk embedding cache
+sys.path.append("../pipeline")
+from embedding_cache import encode_cached
+from ST_filter_data import load_encoder
+from scoring_head import ScoringHead
+from sklearn.model_selection import cross_val_predict
+from sklearn.neural_network import MLPRegressor
+
+# Also emit a NumPy scoring head (../../models/scoring_head.npz) that ST_filter_data can use instead of the pickle
+EMIT_SCORING_HEAD = True
+BASELINE_ACCURACY = 0.843  # Random Forest test accuracy recorded in model_info.json
+
+# CV folds of every surviving model run as one round in the process pool. After PRUNE_AFTER_FOLDS rounds,
+# a model whose mean fold accuracy is more than PRUNE_MARGIN behind the leader is dropped from later rounds
+N_FOLDS = 5
+PRUNE_AFTER_FOLDS = 2
+PRUNE_MARGIN = 0.03
+MAX_WORKERS = os.cpu_count()
+
+# Each worker process trains one model at a time, so the models themselves stay single threaded
 models = {
     'Logistic Regression': LogisticRegression(random_state=42),
-    'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42),
+    'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=1),
     'Gradient Boosting': GradientBoostingClassifier(n_estimators=100, random_state=42),
-    'XGBoost': XGBClassifier(random_state=42, eval_metric='logloss'),
+    'XGBoost': XGBClassifier(random_state=42, eval_metric='logloss', n_jobs=1),
     'SVM (RBF)': SVC(kernel='rbf', random_state=42, probability=True)
 }
 
-print("\n\n\nCross-validation comparison")
-print("="*60)
-
-cv_results = {}
-cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-
-for name, clf in models.items():
-    scores = cross_val_score(clf, embeddings, labels, cv=cv, scoring = 'accuracy')
-    cv_results[name] = {
-        'mean': scores.mean(),
-        'std': scores.std(),
-        'scores': scores
-    }
-    print(f"{name:20}: {scores.mean():.3f} (+/- {scores.std() * 2:.3f})")
-
-print("Detailed evaluation on test set")
-print("="*60)
-
-# Train/test split
-X_train, X_test, y_train, y_test = train_test_split(embeddings, labels, test_size=0.2, random_state=42)
-
-test_results = {}
-
-for name, clf in models.items():
-    print(f"\n{name}")
-    print("-" * 40)
-    
-    clf.fit(X_train, y_train)
-    y_pred = clf.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    test_results[name] = accuracy
-    
-    print(f"Test Accuracy: {accuracy:.3f}")
-    print(classification_report(y_test, y_pred))
+cv = StratifiedKFold(n_splits=N_FOLDS, shuffle=True, random_state=42)
+
+# Set in every worker by init_worker, so the embeddings are sent once per process instead of once per task
+_X = None
+_y = None
+
+
+def init_worker(X, y):
+    global _X, _y
+    _X, _y = X, y
+
+
+def fit_and_score(name, train_idx, test_idx):
+    """Fit a fresh copy of models[name] on train_idx, returns (accuracy, predictions, fit seconds)"""
+    clf = clone(models[name])
+    start_time = time.perf_counter()
+    clf.fit(_X[train_idx], _y[train_idx])
+    elapsed = time.perf_counter() - start_time
 
-print("="*60)
-print("FINAL COMPARISON")
-print("="*60)
+    y_pred = clf.predict(_X[test_idx])
+    return accuracy_score(_y[test_idx], y_pred), y_pred, elapsed
 
-comparison_df = pd.DataFrame({
-    'CV_Mean': [cv_results[name]['mean'] for name in models.keys()],
-    'CV_Std': [cv_results[name]['std'] for name in models.keys()],
-    'Test_Accuracy': [test_results[name] for name in models.keys()]
-}, index=models.keys())
 
-comparison_df = comparison_df.sort_values('CV_Mean', ascending=False)
+def cross_validate(pool, embeddings, labels):
+    folds = list(cv.split(embeddings, labels))
+    cv_results = {name: {'scores': [], 'fit_seconds': 0.0, 'pruned_after': None} for name in models}
+    alive = list(models)
 
-print(comparison_df.round(3))
-
-print(f"\nBest model (CV): {comparison_df.index[0]}")
-print(f"Best model (Test): {max(test_results.items(), key=lambda x: x[1])[0]}")
-
-
-# Find the best model
-best_model_name = max(test_results.items(), key=lambda x: x[1])[0]
-best_classifier = models[best_model_name]
-
-# Train the best model on full dataset (optional - for better performance)
-best_classifier.fit(embeddings, labels)  # Train on all data instead of just training split
-
-# Save the sentence transformer model
-model.save("../../models/sentence_transformer_model")
-
-# Save the best classifier
-with open("../../models/best_classifier.pkl", "wb") as f:
-    pickle.dump(best_classifier, f)
-
-# Save model metadata
-model_info = {
-    "best_model_name": best_model_name,
-    "test_accuracy": test_results[best_model_name],
-    "cv_mean": cv_results[best_model_name]['mean'],
-    "cv_std": cv_results[best_model_name]['std']
-}
-
-with open("../../models/model_info.json", "w") as f:
-    json.dump(model_info, f, indent=2)
+    for fold, (train_idx, test_idx) in enumerate(folds):
+        futures = {name: pool.submit(fit_and_score, name, train_idx, test_idx) for name in alive}
+        for name, future in futures.items():
+            accuracy, _, elapsed = future.result()
+            cv_results[name]['scores'].append(accuracy)
+            cv_results[name]['fit_seconds'] += elapsed
+
+        if fold + 1 >= PRUNE_AFTER_FOLDS and fold + 1 < len(folds):
+            leader = max(np.mean(cv_results[name]['scores']) for name in alive)
+            for name in list(alive):
+                if np.mean(cv_results[name]['scores']) < leader - PRUNE_MARGIN:
+                    alive.remove(name)
+                    cv_results[name]['pruned_after'] = fold + 1
+                    print(f"Pruned {name} after {fold + 1} folds ({np.mean(cv_results[name]['scores']):.3f} vs {leader:.3f})")
+
+    for name, result in cv_results.items():
+        scores = np.array(result['scores'])
+        result['mean'] = scores.mean()
+        result['std'] = scores.std()
+        print(f"{name:20}: {scores.mean():.3f} (+/- {scores.std() * 2:.3f}) over {len(scores)} folds, "
+              f"{result['fit_seconds']:.1f}s fitting")
+
+    return cv_results, alive
+
+
+def main():
+    # Load labeled data
+    with open("../../data/sentence-transformer/labeled_comments_formatted.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    texts = [d["text"] for d in data if d["label"] is not None]
+    labels = np.array([d["label"] for d in data if d["label"] is not None])
+
+    # Embed comments with the pipeline's encoder, so both share one cache identity and only texts labeled since
+    # the last run (or never filtered by the pipeline) miss the cache
+    model = load_encoder("torch")
+    start_time = time.perf_counter()
+    embeddings = np.asarray(encode_cached(model, texts))
+    print(f"Embedded {len(texts)} comments in {time.perf_counter() - start_time:.1f}s")
+
+    # Train/test split
+    indices = np.arange(len(labels))
+    train_idx, test_idx = train_test_split(indices, test_size=0.2, random_state=42)
+    X_train, X_test = embeddings[train_idx], embeddings[test_idx]
+    y_train, y_test = labels[train_idx], labels[test_idx]
+
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=init_worker, initargs=(embeddings, labels)) as pool:
+        print("\n\n\nCross-validation comparison")
+        print("="*60)
+        cv_results, survivors = cross_validate(pool, embeddings, labels)
+
+        print("Detailed evaluation on test set")
+        print("="*60)
+
+        futures = {name: pool.submit(fit_and_score, name, train_idx, test_idx) for name in survivors}
+        test_results = {}
+        test_seconds = {}
+        for name, future in futures.items():
+            accuracy, y_pred, elapsed = future.result()
+            test_results[name] = accuracy
+            test_seconds[name] = elapsed
+
+            print(f"\n{name}")
+            print("-" * 40)
+            print(f"Test Accuracy: {accuracy:.3f}")
+            print(classification_report(y_test, y_pred))
+
+    print("="*60)
+    print("FINAL COMPARISON")
+    print("="*60)
+
+    comparison_df = pd.DataFrame({
+        'CV_Mean': [cv_results[name]['mean'] for name in models.keys()],
+        'CV_Std': [cv_results[name]['std'] for name in models.keys()],
+        'CV_Folds': [len(cv_results[name]['scores']) for name in models.keys()],
+        'Test_Accuracy': [test_results.get(name, np.nan) for name in models.keys()]
+    }, index=models.keys())
+
+    comparison_df = comparison_df.sort_values('CV_Mean', ascending=False)
+
+    print(comparison_df.round(3))
+
+    print(f"\nBest model (CV): {comparison_df.index[0]}")
+    print(f"Best model (Test): {max(test_results.items(), key=lambda x: x[1])[0]}")
+
+
+    # Find the best model
+    best_model_name = max(test_results.items(), key=lambda x: x[1])[0]
+    best_classifier = clone(models[best_model_name])
+
+    # Train the best model on full dataset (optional - for better performance)
+    best_classifier.fit(embeddings, labels)  # Train on all data instead of just training split
+
+    # Save the sentence transformer model
+    model.save("../../models/sentence_transformer_model")
+
+    # Save the best classifier
+    with open("../../models/best_classifier.pkl", "wb") as f:
+        pickle.dump(best_classifier, f)
+
+    # Save model metadata
+    model_info = {
+        "best_model_name": best_model_name,
+        "test_accuracy": test_results[best_model_name],
+        "cv_mean": cv_results[best_model_name]['mean'],
+        "cv_std": cv_results[best_model_name]['std'],
+        "models": {
+            name: {
+                "cv_scores": [float(s) for s in cv_results[name]['scores']],
+                "cv_mean": float(cv_results[name]['mean']),
+                "cv_std": float(cv_results[name]['std']),
+                "cv_fit_seconds": cv_results[name]['fit_seconds'],
+                "pruned_after_folds": cv_results[name]['pruned_after'],
+                "test_accuracy": test_results.get(name),
+                "test_fit_seconds": test_seconds.get(name)
+            }
+            for name in models
+        }
+    }
 
-print(f"\nModels saved:")
-print(f"- Sentence Transformer: ../../models/sentence_transformer_model/")
-print(f"- Best Classifier ({best_model_name}): ../../models/best_classifier.pkl")
-print(f"- Model Info: ../../models/model_info.json")
\ No newline at end of file
+    if EMIT_SCORING_HEAD:
+        print("\n" + "="*60)
+        print("COMPACT SCORING HEAD")
+        print("="*60)
+
+        def distill(teacher, X, y):
+            # Out-of-fold teacher probabilities, so the student does not learn the forest's training-set overfit
+            soft_labels = cross_val_predict(teacher, X, y, cv=cv, method='predict_proba')[:, 1]
+            student = MLPRegressor(hidden_layer_sizes=(64,), alpha=1e-3, max_iter=2000, random_state=42)
+            student.fit(X, soft_labels)
+            return ScoringHead.from_mlp_regressor(student, classes=np.unique(y))
+
+        def logistic(X, y):
+            return ScoringHead.from_logistic_regression(LogisticRegression(random_state=42, max_iter=1000).fit(X, y))
+
+        teacher = models[best_model_name]
+        head_builders = {
+            'Logistic Regression head': logistic,
+            f'MLP head distilled from {best_model_name}': lambda X, y: distill(teacher, X, y),
+        }
+
+        head_results = {}
+        for name, build in head_builders.items():
+            head = build(X_train, y_train)
+            head_results[name] = accuracy_score(y_test, head.predict(X_test))
+            print(f"{name:45}: {head_results[name]:.3f} (baseline {BASELINE_ACCURACY:.3f}, {head_results[name] - BASELINE_ACCURACY:+.3f})")
+
+        best_head_name = max(head_results.items(), key=lambda x: x[1])[0]
+        best_head = head_builders[best_head_name](embeddings, labels)
+        best_head.save("../../models/scoring_head.npz")
+
+        model_info["scoring_head"] = {
+            "name": best_head_name,
+            "test_accuracy": head_results[best_head_name],
+            "baseline_accuracy": BASELINE_ACCURACY,
+            "all_heads": head_results
+        }
+        print(f"Saved {best_head_name} to ../../models/scoring_head.npz")
+
+    with open("../../models/model_info.json", "w") as f:
+        json.dump(model_info, f, indent=2)
+
+    print(f"\nModels saved:")
+    print(f"- Sentence Transformer: ../../models/sentence_transformer_model/")
+    print(f"- Best Classifier ({best_model_name}): ../../models/best_classifier.pkl")
+    print(f"- Model Info: ../../models/model_info.json")
+    if EMIT_SCORING_HEAD:
+        print(f"- Scoring Head ({best_head_name}): ../../models/scoring_head.npz")
+
+
+# Worker processes re-import this module, training only runs in the parent
+if __name__ == "__main__":
+    main()